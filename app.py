@@ -1,16 +1,342 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, send_file, jsonify, Response, \
+    stream_with_context, g, has_request_context, before_render_template, template_rendered
 import random
+import threading
+import time
+import traceback
+import uuid
 import mysql.connector
+from mysql.connector import pooling
 import json
+import math
 import io
 import csv
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # population_fitness falls back to scoring one timetable at a time
+    np = None
+
 app = Flask(__name__)
 app.secret_key = 'timetable_generator_secret_key'
+app.jinja_env.globals['cpu_count'] = os.cpu_count() or 1
+
+# Database connection pool: connections kept open / seconds to wait for a free one
+app.config['DB_CONFIG'] = {
+    "host": "localhost",
+    "user": "root",
+    "password": "toor",
+    "database": "xyz"
+}
+app.config['DB_POOL_SIZE'] = 10
+app.config['DB_POOL_TIMEOUT'] = 10
+
+# Background generation jobs: runs at once / waiting in the queue / seconds to keep finished jobs
+app.config['MAX_CONCURRENT_JOBS'] = 2
+app.config['MAX_QUEUED_JOBS'] = 20
+app.config['JOB_TTL_SECONDS'] = 3600
+
+# Fitness worker processes shared by every GA run that asks for workers > 1
+app.config['FITNESS_POOL_WORKERS'] = os.cpu_count() or 1
+
+# Seconds cached solver input and course names are trusted before re-reading them anyway,
+# so changes made outside this process are picked up too
+app.config['DATA_CACHE_TTL'] = 300
+
+# Server-side store for generated/edited timetables; the session only holds the result id
+app.config['RESULT_STORE_PATH'] = os.path.join(app.instance_path, 'results.sqlite3')
+app.config['RESULT_TTL_SECONDS'] = 24 * 3600
+
+
+# In-process metrics, served in Prometheus text format on /metrics
+METRICS = {
+    # name: (type, help)
+    "http_requests_total": ("counter", "Requests handled, by endpoint, method and status"),
+    "http_request_duration_seconds": ("summary", "Time spent handling requests, by endpoint"),
+    "db_queries_total": ("counter", "SQL statements executed, by endpoint (background for solver jobs)"),
+    "db_query_duration_seconds": ("summary", "Time spent in SQL statements, by endpoint"),
+    "template_render_duration_seconds": ("summary", "Jinja rendering time, by template"),
+    "timetable_phase_duration_seconds": ("summary", "Time spent in each timetable generation phase"),
+    "timetable_solver_runs_total": ("counter", "Completed create_timetable runs, by solver"),
+    "timetable_generations_total": ("counter", "GA generations run"),
+    "timetable_annealing_moves_total": ("counter", "Simulated annealing moves tried"),
+    "timetable_repairs_total": ("counter", "Warm-start repairs of the saved timetable"),
+    "timetable_fitness_evaluations_total": ("counter", "Full fitness evaluations"),
+    "timetable_fitness_cache_hits_total": ("counter", "Fitness lookups answered from a cached score"),
+    "timetable_fitness_cache_hit_ratio": ("gauge", "Share of fitness lookups answered from a cached score"),
+    "timetable_last_penalty": ("gauge", "Penalty of the most recent generated timetable"),
+    "timetable_last_hard_violations": ("gauge", "Hard violations left in the most recent generated timetable"),
+}
+_metrics_lock = threading.Lock()
+_metric_values = {}  # (name, sorted label items) -> value, or [count, sum] for summaries
+
+
+def _metric_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def count_metric(name, value=1, **labels):
+    key = _metric_key(name, labels)
+    with _metrics_lock:
+        _metric_values[key] = _metric_values.get(key, 0) + value
+
+
+def set_metric(name, value, **labels):
+    with _metrics_lock:
+        _metric_values[_metric_key(name, labels)] = value
+
+
+def observe_metric(name, seconds, **labels):
+    key = _metric_key(name, labels)
+    with _metrics_lock:
+        entry = _metric_values.get(key)
+        if entry is None:
+            _metric_values[key] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+@contextlib.contextmanager
+def timed(name, **labels):
+    """Observe how long the ``with`` block takes into summary ``name``"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_metric(name, time.perf_counter() - started, **labels)
+
+
+def _endpoint_label():
+    return (request.endpoint or "unknown") if has_request_context() else "background"
+
+
+def render_metrics():
+    """Every metric in Prometheus text exposition format"""
+    # Solver and pool counters that are already kept elsewhere
+    set_metric("timetable_fitness_evaluations_total", fitness_stats["misses"])
+    set_metric("timetable_fitness_cache_hits_total", fitness_stats["hits"])
+    set_metric("timetable_fitness_cache_hit_ratio", round(fitness_hit_rate(), 4))
+    with _db_pool_lock:
+        pool = dict(db_pool_stats)
+
+    with _metrics_lock:
+        values = sorted((key, list(value) if isinstance(value, list) else value)
+                        for key, value in _metric_values.items())
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, labels), value in values:
+            if metric != name:
+                continue
+            label_text = ",".join(f'{key}="{str(val)}"' for key, val in labels)
+            label_text = f"{{{label_text}}}" if label_text else ""
+            if kind == "summary":
+                lines.append(f"{name}_count{label_text} {value[0]}")
+                lines.append(f"{name}_sum{label_text} {value[1]:.6f}")
+            else:
+                lines.append(f"{name}{label_text} {value}")
+
+    for key, value in pool.items():
+        kind = "gauge" if key in ("in_use", "peak_in_use") else "counter"
+        lines.append(f"# TYPE db_pool_{key} {kind}")
+        lines.append(f"db_pool_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = _endpoint_label()
+        count_metric("http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+        observe_metric("http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+
+@before_render_template.connect_via(app)
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _record_render_time(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        observe_metric("template_render_duration_seconds", time.perf_counter() - started, template=template.name)
+
+
+class _TimedCursor:
+    """Cursor wrapper that counts and times execute/executemany per endpoint"""
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            endpoint = _endpoint_label()
+            count_metric("db_queries_total", endpoint=endpoint)
+            observe_metric("db_query_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(self._cursor.executemany, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TimedConnection:
+    """Pooled connection wrapper whose cursors are _TimedCursor"""
+    __slots__ = ('_connection',)
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+# Versioned in-process cache of read-mostly data
+_data_cache = {}
+_data_cache_lock = threading.Lock()
+_data_version = 0
+
+
+def invalidate_data_cache():
+    """
+    Bump the data version so cached solver input and course names are rebuilt
+    on next use. Call it after any write to course_subjects, subject_assignments,
+    subject_periods, teacher_details or courses.
+    """
+    global _data_version
+    with _data_cache_lock:
+        _data_version += 1
+
+
+def _cached(key, loader, stamp=None):
+    """
+    Return the cached value for ``key``, calling ``loader`` when the version or TTL says it is stale.
+    A ``stamp`` (anything comparable) also makes the entry stale whenever it differs from the cached one.
+    """
+    with _data_cache_lock:
+        version = _data_version
+        entry = _data_cache.get(key)
+        if (entry and entry[0] == version and entry[3] == stamp
+                and time.monotonic() - entry[1] < app.config['DATA_CACHE_TTL']):
+            return entry[2]
+
+    value = loader()
+    with _data_cache_lock:
+        # Don't store a value that was read while a write invalidated the cache
+        if _data_version == version:
+            _data_cache[key] = (version, time.monotonic(), value, stamp)
+    return value
+
+
+# Server-side result store
+RESULTS_DDL = """
+    CREATE TABLE IF NOT EXISTS results (
+        id TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL,
+        payload BLOB NOT NULL
+    )
+"""
+
+
+def _open_result_store():
+    """Open the SQLite result store, creating it on first use"""
+    path = app.config['RESULT_STORE_PATH']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute(RESULTS_DDL)
+    return conn
+
+
+def store_result(data):
+    """
+    Save a JSON-serializable result (zlib-compressed compact JSON) and return its id.
+    Expired results are evicted on the way.
+    """
+    result_id = uuid.uuid4().hex
+    payload = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+    now = time.time()
+    conn = _open_result_store()
+    try:
+        with conn:
+            conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+            conn.execute("INSERT INTO results (id, expires_at, payload) VALUES (?, ?, ?)",
+                         (result_id, now + app.config['RESULT_TTL_SECONDS'], payload))
+    finally:
+        conn.close()
+    return result_id
+
+
+def store_timetable(timetable, batches):
+    """store_result for a timetable keyed by BatchKey (stored with batch strings); returns its id"""
+    return store_result({"timetable": batch_strings(timetable), "batches": [str(batch) for batch in batches]})
+
+
+def load_timetable(result_id):
+    """``(timetable, batches)`` keyed by BatchKey for a store_timetable id, or None if it is unknown or expired"""
+    result = load_result(result_id)
+    if result is None:
+        return None
+    batches = [BatchKey.parse(batch) for batch in result["batches"]]
+    return {batch: result["timetable"][name] for batch, name in zip(batches, result["batches"])}, batches
+
+
+def load_result(result_id):
+    """Return a stored result, or None if it is unknown or expired"""
+    if not result_id:
+        return None
+    conn = _open_result_store()
+    try:
+        row = conn.execute("SELECT payload FROM results WHERE id = ? AND expires_at >= ?",
+                           (result_id, time.time())).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
 
 def get_course_map():
+    """Map course_id (as a string) to course name; cached until the data version changes"""
+    return _cached('course_map', _load_course_map)
+
+
+def _load_course_map():
     # Fetch all courses from the database
     db = get_db_connection()
     cursor = db.cursor(dictionary=True)
@@ -20,111 +346,191 @@ def get_course_map():
     """)
     cursor.execute(query)
     courses=cursor.fetchall()
-    print(courses)
     # Create a dictionary to map course_id to course_name
     course_map = {str(course['id']): course['name'] for course in courses}
-    print(course_map)
+    cursor.close()
     return course_map
 
-def format_batch_string(course_id, year, semester, batch_id):
+class BatchKey(namedtuple('BatchKey', ['course_id', 'year', 'semester', 'batch_id'])):
     """
-    Creates a consistently formatted batch string from components.
-    Ensures all components are strings with proper spacing.
-    """
-    return f"{str(course_id)},{str(year)}, {str(semester)}, {str(batch_id)}"
+    Canonical, hashable identity of a batch: its four parts as stripped strings.
 
-def parse_batch_string(batch_string):
-    """
-    Parses a batch string into its components.
-    Returns (course_id, year, semester, batch_id) as strings.
+    This is the key of every batch dict in the app (solver input, timetables,
+    analysis, saved versions) and doubles as the query parameters of a
+    per-batch WHERE clause. Strings only exist at the edges: str() gives the
+    "course,year, semester, batch" form shown in the UI and CSV files and
+    posted back by the editors, and parse() reads it back.
     """
-    try:
-        parts = batch_string.split(',')
-        course_id = parts[0].strip()
-        year = parts[1].strip()
-        semester = parts[2].strip()
-        batch_id = parts[3].strip()
-        return course_id, year, semester, batch_id
-    except Exception as e:
-        print(f"Error parsing batch string '{batch_string}': {str(e)}")
-        # Return default values or raise exception based on your preference
-        return None, None, None, None
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, course_id, year, semester, batch_id):
+        """Key from raw parts (database values of any type)"""
+        return cls(str(course_id).strip(), str(year).strip(), str(semester).strip(), str(batch_id).strip())
+
+    @classmethod
+    def parse(cls, text):
+        """Key from a batch string with any spacing (or braces around the course id); None if it isn't one"""
+        parts = str(text).split(',')
+        if len(parts) != 4:
+            print(f"Error parsing batch string '{text}'")
+            return None
+        return cls.of(parts[0].strip().strip('{}'), *parts[1:])
+
+    def __str__(self):
+        return f"{self.course_id},{self.year}, {self.semester}, {self.batch_id}"
+
+
+@app.template_filter('batch_strings')
+def batch_strings(mapping):
+    """A dict keyed by BatchKey with string keys instead, for |tojson and the editors' data-batch lookups"""
+    return {str(batch): value for batch, value in mapping.items()}
+
+
+# Database connection pool
+_db_pool = None
+_db_pool_lock = threading.Lock()
+db_pool_stats = {
+    "checkouts": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+    "waits": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0
+}
+
+
+def _get_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = pooling.MySQLConnectionPool(
+                pool_name="timetable",
+                pool_size=app.config['DB_POOL_SIZE'],
+                pool_reset_session=True,
+                # One connection serves a whole request, so never leave unread rows behind
+                buffered=True,
+                **app.config['DB_CONFIG']
+            )
+    return _db_pool
+
+
+def _checkout_connection():
+    """Take a connection from the pool, waiting up to DB_POOL_TIMEOUT seconds for one to free up"""
+    pool = _get_db_pool()
+    started = time.monotonic()
+    deadline = started + app.config['DB_POOL_TIMEOUT']
+    waited = False
+
+    while True:
+        try:
+            connection = pool.get_connection()
+            break
+        except mysql.connector.errors.PoolError:
+            if time.monotonic() >= deadline:
+                with _db_pool_lock:
+                    db_pool_stats["timeouts"] += 1
+                raise
+            waited = True
+            time.sleep(0.05)
+
+    with _db_pool_lock:
+        db_pool_stats["checkouts"] += 1
+        db_pool_stats["in_use"] += 1
+        db_pool_stats["peak_in_use"] = max(db_pool_stats["peak_in_use"], db_pool_stats["in_use"])
+        if waited:
+            db_pool_stats["waits"] += 1
+            db_pool_stats["wait_seconds"] += time.monotonic() - started
+    return connection
+
 
 # Database connection function
 def get_db_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="toor",
-        database="xyz"
-    )
+    """
+    Return the pooled connection for the current request (or app context).
+
+    The connection is checked out on first use, shared by every data-access
+    function in the request and handed back to the pool on teardown, so
+    callers only close their cursors.
+    """
+    if 'db' not in g:
+        g.db = _TimedConnection(_checkout_connection())
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    db = g.pop('db', None)
+    if db is None:
+        return
+
+    try:
+        if exception is not None:
+            db.rollback()
+        db.close()  # Returns the connection to the pool
+    except mysql.connector.Error as e:
+        print(f"Error returning connection to pool: {e}")
+    finally:
+        with _db_pool_lock:
+            db_pool_stats["in_use"] -= 1
 
 
 # Fetch subjects and teachers from the database
 def fetch_subjects_and_teachers():
+    """
+    Solver input: {batch: {subject_name: {...}}} with teachers and period limits.
+
+    The result is shared and cached until the data version changes, so treat
+    it as read-only.
+    """
+    return _cached('subjects', _load_subjects_and_teachers)
+
+
+def _load_subjects_and_teachers():
     db = get_db_connection()
     cursor = db.cursor(dictionary=True)
 
+    # Only the columns the solver needs, with period limits joined in
     query = """
     SELECT 
         sa.course_subject_id, 
-        cs.subject_code, cs.subject_name, cs.year, cs.semester, cs.batch_id, cs.course_id, cs.is_active, cs.created_at,
-        td.first_name, td.last_name, td.email, td.phone, td.department, td.appointment_date, td.photo_path
+        cs.subject_code, cs.subject_name, cs.year, cs.semester, cs.batch_id, cs.course_id,
+        td.id AS teacher_id, td.first_name, td.last_name,
+        sp.max_periods_per_day, sp.max_periods_per_week
     FROM subject_assignments sa
     JOIN course_subjects cs ON sa.course_subject_id = cs.id
     JOIN teacher_details td ON sa.teacher_id = td.id
+    LEFT JOIN subject_periods sp ON sp.course_subject_id = cs.id
     WHERE cs.is_active = 1
     """
     cursor.execute(query)
     result = cursor.fetchall()
 
-    # Get periods configuration from the database
-    subject_periods = fetch_subject_periods()
-
     subjects = {}
     for row in result:
         subject_name = row['subject_name']
-        teacher_name = f"{row['first_name']} {row['last_name']}"
-
-        # Use the consistent format_batch_string function
-        batch_name = format_batch_string(
-            row['course_id'],
-            row['year'],
-            row['semester'],
-            row['batch_id']
-        )
 
-        subject_code = row['subject_code']
-        course_subject_id = row['course_subject_id']
-        teacher_details = {
-            "name": teacher_name,
-            "email": row['email'],
-            "phone": row['phone'],
-            "department": row['department'],
-            "appointment_date": row['appointment_date'],
-            "photo_path": row['photo_path']
-        }
+        batch_name = BatchKey.of(row['course_id'], row['year'], row['semester'], row['batch_id'])
 
         if batch_name not in subjects:
             subjects[batch_name] = {}
 
         if subject_name not in subjects[batch_name]:
             # Use saved periods if available, otherwise use defaults
-            if course_subject_id in subject_periods:
-                max_periods_per_day = subject_periods[course_subject_id]['max_periods_per_day']
-                max_periods_per_week = subject_periods[course_subject_id]['max_periods_per_week']
+            if row['max_periods_per_day'] is not None:
+                max_periods_per_day = row['max_periods_per_day']
+                max_periods_per_week = row['max_periods_per_week']
             else:
                 # Default values if no configuration exists
                 max_periods_per_day = 1
                 max_periods_per_week = 3
 
             subjects[batch_name][subject_name] = {
-                "subject_code": subject_code,
-                "course_subject_id": course_subject_id,
+                "subject_code": row['subject_code'],
+                "course_subject_id": row['course_subject_id'],
                 "teachers": [],
                 "details": {
-                    "course_id": row['course_id'],
-                    "created_at": row['created_at']
+                    "course_id": row['course_id']
                 },
                 "constraints": {
                     "max_periods_per_day": max_periods_per_day,
@@ -132,321 +538,1389 @@ def fetch_subjects_and_teachers():
                 }
             }
 
-        subjects[batch_name][subject_name]["teachers"].append(teacher_details)
+        subjects[batch_name][subject_name]["teachers"].append({
+            "id": row['teacher_id'],
+            "name": f"{row['first_name']} {row['last_name']}"
+        })
 
     cursor.close()
-    db.close()
+    return subjects
+
+
+# Offline problem snapshots: everything the solver reads from the database, in one file.
+# Layout: SNAPSHOT_MAGIC, one version byte, then zlib-compressed compact JSON with
+# teachers interned into a table and subjects stored as fixed-position rows.
+SNAPSHOT_MAGIC = b"TTSNAP"
+SNAPSHOT_VERSION = 1
+
+
+def dump_snapshot(subjects):
+    """Encode a fetch_subjects_and_teachers-style dict as snapshot bytes"""
+    teachers = []
+    teacher_index = {}
+    batches = []
+    for batch, batch_subjects in subjects.items():
+        rows = []
+        for name, info in batch_subjects.items():
+            refs = []
+            for teacher in info["teachers"]:
+                key = (teacher.get("id"), teacher["name"])
+                if key not in teacher_index:
+                    teacher_index[key] = len(teachers)
+                    teachers.append(list(key))
+                refs.append(teacher_index[key])
+            rows.append([
+                name, info["subject_code"], info["course_subject_id"], info["details"].get("course_id"),
+                info["constraints"]["max_periods_per_day"], info["constraints"]["max_periods_per_week"], refs
+            ])
+        batches.append([str(batch), rows])
+
+    payload = {"created": datetime.now().isoformat(timespec="seconds"), "teachers": teachers, "batches": batches}
+    body = zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 9)
+    return SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]) + body
+
+
+def load_snapshot(data):
+    """
+    Decode snapshot bytes (or read them from a path) back into the subjects
+    dict fetch_subjects_and_teachers returns. Raises ValueError for anything
+    that isn't a snapshot this version can read.
+    """
+    if isinstance(data, str):
+        with open(data, 'rb') as f:
+            data = f.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("Not a timetable snapshot")
+    if len(data) <= len(SNAPSHOT_MAGIC) + 1:
+        raise ValueError("Truncated timetable snapshot")
+    version = data[len(SNAPSHOT_MAGIC)]
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {version} is newer than this app supports ({SNAPSHOT_VERSION})")
+
+    # A damaged body can fail anywhere from decompression to unpacking a row
+    try:
+        payload = json.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC) + 1:]).decode('utf-8'))
+        teachers = [{"id": teacher_id, "name": name} for teacher_id, name in payload["teachers"]]
+        subjects = {}
+        for batch, rows in payload["batches"]:
+            key = BatchKey.parse(batch)
+            if key is None:
+                raise ValueError(f"bad batch {batch!r}")
+            subjects[key] = {}
+            for name, code, course_subject_id, course_id, max_day, max_week, refs in rows:
+                subjects[key][name] = {
+                    "subject_code": code,
+                    "course_subject_id": course_subject_id,
+                    "teachers": [dict(teachers[ref]) for ref in refs],
+                    "details": {"course_id": course_id},
+                    "constraints": {"max_periods_per_day": max_day, "max_periods_per_week": max_week}
+                }
+    except (zlib.error, ValueError, KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"Corrupt timetable snapshot: {e}") from e
     return subjects
 
 
 # Timetable configuration
 days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+# Stored next to the day name in timetable_assignments.day_ordinal so reads sort on an integer
+DAY_ORDINALS = {day: d for d, day in enumerate(days)}
 periods_per_day = 7
+cells_per_batch = len(days) * periods_per_day
+
+
+# Compiled problem instance the GA operates on
+class Problem:
+    """
+    Integer-encoded view of ``subjects`` and ``batches`` for the GA.
+
+    Batches, subjects and teachers are interned to small ints once per run so
+    the GA never formats or re-splits "Subject (Teacher)" strings. Subjects are
+    interned per batch (a subject name is only unique inside its batch) and
+    teachers by name, which is how the fitness has always keyed clashes.
+    A gene is a single int: 0 is a free period, anything else indexes
+    ``gene_subject`` / ``gene_teacher`` / ``gene_label``.
+    """
+    __slots__ = (
+        'subjects', 'batches', 'batch_index',
+        'subject_name', 'subject_batch', 'max_per_day', 'max_per_week',
+        'batch_subjects', 'subject_genes', 'teacher_names',
+        'gene_subject', 'gene_teacher', 'gene_label', 'gene_lookup',
+        'n_cells', '_vector_tables',
+    )
+
+    def __init__(self, subjects, batches):
+        self.subjects = subjects
+        self.batches = list(batches)
+        self.batch_index = {batch: b for b, batch in enumerate(self.batches)}
+        self.subject_name = []
+        self.subject_batch = []
+        self.max_per_day = []
+        self.max_per_week = []
+        self.batch_subjects = []
+        self.subject_genes = []
+        self.teacher_names = []
+        self.gene_subject = [-1]
+        self.gene_teacher = [-1]
+        self.gene_label = [""]
+        self.gene_lookup = {}
+        teacher_index = {}
+
+        for b, batch in enumerate(self.batches):
+            batch_subjects = []
+            for subject, info in subjects[batch].items():
+                s = len(self.subject_name)
+                batch_subjects.append(s)
+                self.subject_name.append(subject)
+                self.subject_batch.append(b)
+                self.max_per_day.append(info["constraints"]["max_periods_per_day"])
+                self.max_per_week.append(info["constraints"]["max_periods_per_week"])
+
+                # One gene per teacher entry so random.choice keeps the same weighting
+                genes = []
+                for teacher in info["teachers"]:
+                    name = teacher["name"]
+                    if name not in teacher_index:
+                        teacher_index[name] = len(self.teacher_names)
+                        self.teacher_names.append(name)
+                    gene = self.gene_lookup.get((b, subject, name))
+                    if gene is None:
+                        gene = len(self.gene_subject)
+                        self.gene_subject.append(s)
+                        self.gene_teacher.append(teacher_index[name])
+                        self.gene_label.append(f"{subject} ({name})")
+                        self.gene_lookup[(b, subject, name)] = gene
+                    genes.append(gene)
+                self.subject_genes.append(genes)
+            self.batch_subjects.append(batch_subjects)
+
+        self.n_cells = len(self.batches) * cells_per_batch
+        self._vector_tables = None
+
+    def vector_tables(self):
+        """NumPy lookup tables for population_fitness, built on first use"""
+        if self._vector_tables is None:
+            n_batches = len(self.batches)
+            width = max((len(batch_subjects) for batch_subjects in self.batch_subjects), default=0) or 1
+            subject_local = [0] * len(self.subject_name)
+            max_day = np.zeros((n_batches, width), dtype=np.int64)
+            max_week = np.zeros((n_batches, width), dtype=np.int64)
+            for b, batch_subjects in enumerate(self.batch_subjects):
+                for local, s in enumerate(batch_subjects):
+                    subject_local[s] = local
+                    max_day[b, local] = self.max_per_day[s]
+                    max_week[b, local] = self.max_per_week[s]
+
+            self._vector_tables = {
+                "gene_subject": np.array(self.gene_subject, dtype=np.int64),
+                "gene_teacher": np.array(self.gene_teacher, dtype=np.int64),
+                "gene_local": np.array([0] + [subject_local[s] for s in self.gene_subject[1:]], dtype=np.int64),
+                "width": width,
+                "max_day": max_day,
+                "max_week": max_week,
+            }
+        return self._vector_tables
+
+    def fingerprint(self):
+        """Digest of everything fitness reads, so worker processes can keep a compiled problem across runs"""
+        scored = (len(self.batches), len(self.teacher_names), self.gene_subject, self.gene_teacher,
+                  self.max_per_day, self.max_per_week, self.batch_subjects)
+        return hashlib.sha1(repr(scored).encode()).hexdigest()
+
+
+class Genome:
+    """
+    Flat, array-backed timetable.
+
+    ``cells[b * cells_per_batch + d * periods_per_day + p]`` holds the gene for
+    batch ``b``, day ``d`` and period ``p``. ``score`` caches the fitness and
+    is reset to None by anything that changes ``cells``.
+    """
+    __slots__ = ('cells', 'score')
+
+    def __init__(self, cells, score=None):
+        self.cells = cells
+        self.score = score
+
+    def copy(self):
+        return Genome(self.cells[:], self.score)
+
+
+class TeacherOccupancy:
+    """
+    Which teachers are busy in which of the week's slots, across all batches.
+
+    ``masks[t]`` has bit ``slot`` (``d * periods_per_day + p``) set while
+    teacher ``t`` teaches somewhere in that slot, so a free/busy check is a
+    single AND on a 35-bit int. ``extra`` counts occupants beyond the first
+    per (teacher, slot) -- the clashes -- so removing one of two clashing
+    classes leaves the teacher busy. ``clashes`` is their total.
+    """
+    __slots__ = ('masks', 'extra', 'clashes')
+
+    def __init__(self, n_teachers):
+        self.masks = [0] * n_teachers
+        self.extra = {}
+        self.clashes = 0
+
+    @classmethod
+    def from_cells(cls, cells, problem):
+        occupancy = cls(len(problem.teacher_names))
+        gene_teacher = problem.gene_teacher
+        for i, gene in enumerate(cells):
+            if gene:
+                occupancy.add(gene_teacher[gene], i % cells_per_batch)
+        return occupancy
+
+    def is_free(self, teacher, slot):
+        return not self.masks[teacher] >> slot & 1
+
+    def count(self, teacher, slot):
+        """Number of classes the teacher has in the slot"""
+        return (self.masks[teacher] >> slot & 1) + self.extra.get((teacher, slot), 0)
+
+    def add(self, teacher, slot):
+        """Mark the teacher busy in the slot; returns True if that is a clash"""
+        bit = 1 << slot
+        if self.masks[teacher] & bit:
+            key = (teacher, slot)
+            self.extra[key] = self.extra.get(key, 0) + 1
+            self.clashes += 1
+            return True
+        self.masks[teacher] |= bit
+        return False
+
+    def remove(self, teacher, slot):
+        """Drop one of the teacher's classes in the slot; returns True if that resolved a clash"""
+        key = (teacher, slot)
+        extra = self.extra.get(key)
+        if extra:
+            if extra == 1:
+                del self.extra[key]
+            else:
+                self.extra[key] = extra - 1
+            self.clashes -= 1
+            return True
+        self.masks[teacher] &= ~(1 << slot)
+        return False
+
+
+# Process-wide fitness cache counters
+fitness_stats = {"hits": 0, "misses": 0}
+
+
+def fitness_hit_rate():
+    """Share of fitness lookups answered from a genome's cached score"""
+    total = fitness_stats["hits"] + fitness_stats["misses"]
+    return fitness_stats["hits"] / total if total else 0.0
+
+
+def evaluate(genome, problem):
+    """Return the fitness of a genome, scoring it only if its cached score is stale"""
+    if genome.score is None:
+        fitness_stats["misses"] += 1
+        genome.score = fitness(genome, problem)
+    else:
+        fitness_stats["hits"] += 1
+    return genome.score
+
+
+def decode_timetable(genome, problem):
+    """Convert a genome back to the {batch: {day: ["Subject (Teacher)", ...]}} format"""
+    labels = problem.gene_label
+    cells = genome.cells
+    timetable = {}
+    for b, batch in enumerate(problem.batches):
+        base = b * cells_per_batch
+        timetable[batch] = {
+            day: [labels[g] for g in cells[base + d * periods_per_day:base + (d + 1) * periods_per_day]]
+            for d, day in enumerate(days)
+        }
+    return timetable
+
+
+def encode_timetable(timetable, problem):
+    """Convert a {batch: {day: [...]}} timetable into a genome; unknown entries become free periods"""
+    cells = [0] * problem.n_cells
+    for batch, batch_data in timetable.items():
+        b = problem.batch_index.get(batch)
+        if b is None:
+            continue
+        for d, day in enumerate(days):
+            for period, entry in enumerate(batch_data.get(day, [])[:periods_per_day]):
+                if entry and " (" in entry:
+                    subject, teacher = entry.rsplit(" (", 1)
+                    gene = problem.gene_lookup.get((b, subject, teacher.rstrip(")")))
+                    if gene:
+                        cells[b * cells_per_batch + d * periods_per_day + period] = gene
+    return Genome(cells)
 
 
 # Generate initial population with empty slots allowed
-def generate_initial_population(subjects, batches, population_size):
+def generate_initial_population(problem, population_size, rng=random):
     population = []
+    max_per_week = problem.max_per_week
     for _ in range(population_size):
-        timetable = {batch: {day: [""] * periods_per_day for day in days} for batch in batches}
-        for batch in batches:
-            # Initialize subject weekly counters
-            subject_counters = {subject: 0 for subject in subjects[batch]}
+        cells = [0] * problem.n_cells
+        # Initialize subject weekly counters
+        subject_counters = [0] * len(problem.subject_name)
 
-            # First pass: try to assign subjects without exceeding constraints
-            for day in days:
+        for b, batch_subjects in enumerate(problem.batch_subjects):
+            for d in range(len(days)):
+                start = b * cells_per_batch + d * periods_per_day
                 # Shuffle periods to randomize initial assignments
                 period_indices = list(range(periods_per_day))
-                random.shuffle(period_indices)
+                rng.shuffle(period_indices)
 
                 for period in period_indices:
                     # Randomly decide if this period should be assigned or left empty
-                    if random.random() < 0.8:  # 80% chance of assignment
+                    if rng.random() < 0.8:  # 80% chance of assignment
                         # Find eligible subjects (not exceeding weekly limit)
                         eligible_subjects = [
-                            sub for sub in subjects[batch]
-                            if subject_counters[sub] < subjects[batch][sub]["constraints"]["max_periods_per_week"]
+                            s for s in batch_subjects
+                            if subject_counters[s] < max_per_week[s]
                         ]
 
                         if eligible_subjects:
-                            subject = random.choice(eligible_subjects)
-                            teacher = random.choice(subjects[batch][subject]["teachers"])["name"]
-                            timetable[batch][day][period] = f"{subject} ({teacher})"
-                            subject_counters[subject] += 1
+                            s = rng.choice(eligible_subjects)
+                            cells[start + period] = rng.choice(problem.subject_genes[s])
+                            subject_counters[s] += 1
 
-        population.append(timetable)
+        population.append(Genome(cells))
     return population
 
 
-# Fitness function with updated scoring to prefer consecutive classes and respect max periods
-def fitness(timetable, subjects, batches):
-    penalty = 0
-    teacher_schedule = {teacher["name"]: {day: [""] * periods_per_day for day in days} for batch in subjects for sub in
-                        subjects[batch] for teacher in subjects[batch][sub]["teachers"]}
 
-    for batch in batches:
-        subject_weekly_count = {sub: 0 for sub in subjects[batch]}  # Track weekly count
+# Greedy randomized (GRASP) construction of a near-feasible initial population
+def generate_grasp_population(problem, population_size, alpha=0.3, rng=random):
+    """
+    Build each timetable by placing the most constrained subjects first.
+
+    Subjects are ordered by how few teachers can take them and how loaded
+    those teachers are across all batches, with random noise so every genome
+    gets a different order. Each period is placed in a cell that keeps the
+    subject under its daily limit and has a teacher free in that slot in every
+    batch; the cell is drawn at random from the ``alpha`` best candidates
+    (next to the same subject, then next to any class). Periods that cannot be
+    placed without a clash are left free, so the result starts without hard
+    violations whenever the instance allows it.
+    """
+    gene_teacher = problem.gene_teacher
+    max_per_day = problem.max_per_day
+    max_per_week = problem.max_per_week
+    n_subjects = len(problem.subject_name)
+
+    subject_teachers = [sorted({gene_teacher[gene] for gene in problem.subject_genes[s]}) for s in range(n_subjects)]
+    teacher_load = [0.0] * len(problem.teacher_names)
+    for s in range(n_subjects):
+        for t in subject_teachers[s]:
+            teacher_load[t] += max_per_week[s] / len(subject_teachers[s])
+    difficulty = [
+        max((teacher_load[t] for t in subject_teachers[s]), default=0) / len(subject_teachers[s])
+        if subject_teachers[s] else 0
+        for s in range(n_subjects)
+    ]
+
+    population = []
+    for _ in range(population_size):
+        cells = [0] * problem.n_cells
+        occupancy = TeacherOccupancy(len(problem.teacher_names))
+        order = sorted((s for s in range(n_subjects) if problem.subject_genes[s]),
+                       key=lambda s: -difficulty[s] * rng.uniform(0.8, 1.2))
+
+        for s in order:
+            base = problem.subject_batch[s] * cells_per_batch
+            genes = problem.subject_genes[s]
+            daily = [0] * len(days)
+            for _ in range(max_per_week[s]):
+                candidates = []
+                for slot in range(cells_per_batch):
+                    d, period = divmod(slot, periods_per_day)
+                    if cells[base + slot] or daily[d] >= max_per_day[s]:
+                        continue
+                    free = [gene for gene in genes if occupancy.is_free(gene_teacher[gene], slot)]
+                    if not free:
+                        continue
+                    cost = 0
+                    for neighbour in (period - 1, period + 1):
+                        if 0 <= neighbour < periods_per_day:
+                            other = cells[base + d * periods_per_day + neighbour]
+                            if other:
+                                cost -= 3 if problem.gene_subject[other] == s else 1
+                    candidates.append((cost, slot, free))
+                if not candidates:
+                    break
+
+                # Restricted candidate list: anything within alpha of the best cost
+                best = min(c[0] for c in candidates)
+                worst = max(c[0] for c in candidates)
+                threshold = best + alpha * (worst - best)
+                _, slot, free = rng.choice([c for c in candidates if c[0] <= threshold])
+                gene = rng.choice(free)
+                cells[base + slot] = gene
+                occupancy.add(gene_teacher[gene], slot)
+                daily[slot // periods_per_day] += 1
+
+        population.append(Genome(cells))
+    return population
 
-        # First check weekly limits
-        for day in days:
-            daily_subject_count = {sub: 0 for sub in subjects[batch]}
-            for period in range(periods_per_day):
-                entry = timetable[batch][day][period]
-                if entry:  # Skip empty periods
-                    subject, teacher = entry.rsplit(" (", 1)
-                    teacher = teacher.rstrip(")")
 
-                    # Count subject occurrences
-                    daily_subject_count[subject] += 1
-                    subject_weekly_count[subject] += 1
+# Initial population builders selectable from the /generate form
+INITIALIZERS = {
+    "random": generate_initial_population,
+    "grasp": generate_grasp_population,
+}
+
+# Fitness function with updated scoring to prefer consecutive classes and respect max periods
+def fitness(genome, problem):
+    penalty = 0
+    cells = genome.cells
+    gene_subject = problem.gene_subject
+    gene_teacher = problem.gene_teacher
+    max_per_day = problem.max_per_day
+    max_per_week = problem.max_per_week
+    # Per-teacher slot bitmasks, as in TeacherOccupancy (inlined: this is the hot loop)
+    teacher_masks = [0] * len(problem.teacher_names)
+    subject_weekly_count = [0] * len(problem.subject_name)
+
+    for b, batch_subjects in enumerate(problem.batch_subjects):
+        base = b * cells_per_batch
+        for d in range(len(days)):
+            start = base + d * periods_per_day
+            daily_subject_count = {}
+            for period in range(periods_per_day):
+                gene = cells[start + period]
+                if gene:  # Skip empty periods
+                    s = gene_subject[gene]
 
                     # Enforce max periods per day
-                    max_periods_per_day = subjects[batch][subject]["constraints"]["max_periods_per_day"]
-                    if daily_subject_count[subject] > max_periods_per_day:
+                    count = daily_subject_count.get(s, 0) + 1
+                    daily_subject_count[s] = count
+                    if count > max_per_day[s]:
                         penalty += 50  # Higher penalty for exceeding daily limit
+                    subject_weekly_count[s] += 1
 
                     # Check teacher conflicts
-                    if teacher_schedule[teacher][day][period] != "":
+                    teacher = gene_teacher[gene]
+                    bit = 1 << (start - base + period)
+                    if teacher_masks[teacher] & bit:
                         penalty += 100  # Very high penalty for teacher conflicts
                     else:
-                        teacher_schedule[teacher][day][period] = batch
+                        teacher_masks[teacher] |= bit
+
+            for period in range(periods_per_day - 1):
+                current_gene = cells[start + period]
+                next_gene = cells[start + period + 1]
+                # Reward consecutive classes of the same subject
+                if current_gene and next_gene and gene_subject[current_gene] == gene_subject[next_gene]:
+                    penalty -= 2
+
+            for period in range(1, periods_per_day - 1):
+                # Small penalty for isolated empty periods
+                if not cells[start + period] and cells[start + period - 1] and cells[start + period + 1]:
+                    penalty += 1
 
         # Check weekly limits and penalize severely if exceeded
-        for subject, count in subject_weekly_count.items():
-            max_periods_per_week = subjects[batch][subject]["constraints"]["max_periods_per_week"]
-            if count > max_periods_per_week:
-                penalty += 200 * (count - max_periods_per_week)  # Severe penalty for exceeding weekly limits
+        for s in batch_subjects:
+            if subject_weekly_count[s] > max_per_week[s]:
+                penalty += 200 * (subject_weekly_count[s] - max_per_week[s])
 
-        # Reward consecutive periods for the same subject
-        for day in days:
-            for period in range(periods_per_day - 1):
-                current_entry = timetable[batch][day][period]
-                next_entry = timetable[batch][day][period + 1]
+    return penalty
 
-                if current_entry and next_entry:  # Both periods have assignments
-                    current_subject = current_entry.split(" (")[0]
-                    next_subject = next_entry.split(" (")[0]
 
-                    if current_subject == next_subject:
-                        penalty -= 2  # Reward consecutive classes of the same subject
+# Batched fitness for a whole population
+def population_fitness(population, problem, pool=None):
+    """
+    Score every genome in one call and return the penalties in population order.
 
-        # Small penalty for empty periods surrounded by non-empty ones (gaps)
-        for day in days:
-            for period in range(1, periods_per_day - 1):
-                prev_entry = timetable[batch][day][period - 1]
-                current_entry = timetable[batch][day][period]
-                next_entry = timetable[batch][day][period + 1]
+    Genomes with a cached score are skipped; the rest are stacked into a
+    (population, batch, day, period) gene tensor and every term of ``fitness``
+    is computed with array ops, giving exactly the same penalties. Without
+    NumPy it falls back to ``fitness``. With a FitnessPool the stale genomes
+    are split across its worker processes.
+    """
+    stale = [genome for genome in population if genome.score is None]
+    fitness_stats["hits"] += len(population) - len(stale)
+    if stale:
+        fitness_stats["misses"] += len(stale)
+        if pool is not None:
+            scores = pool.score(stale)
+        else:
+            scores = _score_genomes(stale, problem)
+        for genome, score in zip(stale, scores):
+            genome.score = score
+    return [genome.score for genome in population]
 
-                if (prev_entry and next_entry) and not current_entry:
-                    penalty += 1  # Small penalty for isolated empty periods
 
-    return penalty
+def _score_genomes(genomes, problem):
+    if np is None:
+        return [fitness(genome, problem) for genome in genomes]
+    return _vectorized_fitness(genomes, problem)
+
+
+# Parallel fitness evaluation
+_worker_problems = {}  # fingerprint -> Problem, inside each worker process
+_WORKER_PROBLEMS_KEPT = 4
+
+
+def _score_cells(key, chunk, problem=None):
+    """Worker task: score ``chunk``, or return None if the problem ``key`` hasn't been shipped here yet"""
+    if problem is not None:
+        if len(_worker_problems) >= _WORKER_PROBLEMS_KEPT:
+            _worker_problems.pop(next(iter(_worker_problems)))
+        _worker_problems[key] = problem
+    problem = _worker_problems.get(key)
+    if problem is None:
+        return None
+    return _score_genomes([Genome(cells) for cells in chunk], problem)
+
+
+_fitness_executor = None
+_fitness_executor_lock = threading.Lock()
+
+
+def _get_fitness_executor():
+    """
+    The process pool behind every FitnessPool, started on first use and kept
+    for the life of the server. Workers are spawned rather than forked, since
+    the parent is a threaded server with job threads and open connections.
+    """
+    global _fitness_executor
+    with _fitness_executor_lock:
+        if _fitness_executor is None:
+            _fitness_executor = ProcessPoolExecutor(
+                max_workers=app.config['FITNESS_POOL_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _fitness_executor
+
+
+def _reset_fitness_executor(broken):
+    """Forget a broken shared pool, unless another run already replaced it; the next use starts a fresh one"""
+    global _fitness_executor
+    with _fitness_executor_lock:
+        if _fitness_executor is broken:
+            _fitness_executor = None
+    broken.shutdown(wait=False)
+
+
+class FitnessPool:
+    """
+    Scores genomes of one problem on the shared worker processes.
+
+    Each worker keeps the last few compiled problems by fingerprint, so a
+    problem is shipped to a worker once per data version, the first time a
+    task for it lands there; tasks otherwise only carry the gene lists.
+    Scoring is deterministic, so a seeded run gives the same result as
+    serial mode.
+    """
+
+    def __init__(self, problem, workers):
+        self.problem = problem
+        self.key = problem.fingerprint()
+        self.workers = min(workers, app.config['FITNESS_POOL_WORKERS'])
+
+    def score(self, genomes):
+        size = -(-len(genomes) // self.workers)
+        chunks = [[genome.cells for genome in genomes[i:i + size]] for i in range(0, len(genomes), size)]
+        executor = _get_fitness_executor()
+        try:
+            parts = [executor.submit(_score_cells, self.key, chunk) for chunk in chunks]
+            parts = [part.result() for part in parts]
+            # Workers that haven't seen this problem yet get it with a retry of their chunk
+            for n, part in enumerate(parts):
+                if part is None:
+                    parts[n] = executor.submit(_score_cells, self.key, chunks[n], self.problem).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed): drop the pool so the next call starts a fresh one,
+            # and score this generation here so the run still finishes
+            _reset_fitness_executor(executor)
+            return _score_genomes(genomes, self.problem)
+        return [score for part in parts for score in part]
+
+
+def _vectorized_fitness(population, problem):
+    tables = problem.vector_tables()
+    n_pop = len(population)
+    n_batches = len(problem.batches)
+    n_days = len(days)
+    n_teachers = len(problem.teacher_names)
+    width = tables["width"]
+
+    genes = np.array([genome.cells for genome in population], dtype=np.int64)
+    genes = genes.reshape(n_pop, n_batches, n_days, periods_per_day)
+    filled = genes != 0
+    subject = tables["gene_subject"][genes]
+
+    # Daily counts per (individual, batch, day, subject within batch)
+    group = np.arange(n_pop * n_batches * n_days).reshape(n_pop, n_batches, n_days, 1)
+    keys = group * width + tables["gene_local"][genes]
+    daily = np.bincount(keys[filled], minlength=n_pop * n_batches * n_days * width)
+    daily = daily.reshape(n_pop, n_batches, n_days, width)
+    penalty = 50 * np.maximum(daily - tables["max_day"][None, :, None, :], 0).sum(axis=(1, 2, 3))
+
+    # Weekly limits
+    weekly = daily.sum(axis=2)
+    penalty += 200 * np.maximum(weekly - tables["max_week"][None], 0).sum(axis=(1, 2))
+
+    # Teacher clashes: every occupant of a (teacher, day, period) slot after the first
+    slot = np.arange(cells_per_batch).reshape(1, 1, n_days, periods_per_day)
+    individual = np.arange(n_pop).reshape(n_pop, 1, 1, 1)
+    keys = (individual * n_teachers + tables["gene_teacher"][genes]) * cells_per_batch + slot
+    # Count repeats among the occupied keys only, so memory follows the filled cells, not teachers x slots
+    keys = np.sort(keys[filled])
+    repeats = keys[1:][keys[1:] == keys[:-1]]
+    penalty += 100 * np.bincount(repeats // (n_teachers * cells_per_batch), minlength=n_pop)
+
+    # Reward consecutive classes of the same subject
+    consecutive = filled[..., :-1] & filled[..., 1:] & (subject[..., :-1] == subject[..., 1:])
+    penalty -= 2 * consecutive.sum(axis=(1, 2, 3))
+
+    # Small penalty for isolated empty periods
+    gaps = ~filled[..., 1:-1] & filled[..., :-2] & filled[..., 2:]
+    penalty += gaps.sum(axis=(1, 2, 3))
+
+    return penalty.tolist()
+
+
+# Incremental fitness for single-cell edits
+class FitnessState:
+    """
+    Incremental evaluator for one genome.
+
+    Keeps per-day and weekly subject counters, a TeacherOccupancy index and
+    the running penalty and hard-violation count, so changing one cell is
+    scored in O(1) instead of re-running ``fitness``. ``move_delta``/``moves_delta`` price a move without
+    applying it; ``assign`` applies it and keeps ``genome.score`` in sync.
+    ``fitness`` stays the reference implementation (see ``verify``).
+    """
+    __slots__ = ('genome', 'problem', 'daily', 'weekly', 'occupancy', 'penalty', 'hard')
+
+    def __init__(self, genome, problem):
+        self.genome = genome
+        self.problem = problem
+        n_subjects = len(problem.subject_name)
+        # daily[d * n_subjects + s], weekly[s]
+        self.daily = [0] * (len(days) * n_subjects)
+        self.weekly = [0] * n_subjects
+        self.occupancy = TeacherOccupancy(len(problem.teacher_names))
+
+        cells = genome.cells
+        gene_subject = problem.gene_subject
+        gene_teacher = problem.gene_teacher
+        for i, gene in enumerate(cells):
+            if gene:
+                slot = i % cells_per_batch
+                s = gene_subject[gene]
+                self.daily[slot // periods_per_day * n_subjects + s] += 1
+                self.weekly[s] += 1
+                self.occupancy.add(gene_teacher[gene], slot)
+
+        penalty = 0
+        hard = self.occupancy.clashes
+        for s in range(n_subjects):
+            excess = max(self.weekly[s] - problem.max_per_week[s], 0)
+            penalty += 200 * excess
+            hard += excess
+            for d in range(len(days)):
+                excess = max(self.daily[d * n_subjects + s] - problem.max_per_day[s], 0)
+                penalty += 50 * excess
+                hard += excess
+        penalty += 100 * self.occupancy.clashes
+        self.hard = hard
+        for start in range(0, problem.n_cells, periods_per_day):
+            penalty += self._row_cost(start, 0, periods_per_day - 1)
+        self.penalty = penalty
+        genome.score = penalty
+
+    def _row_cost(self, start, first, last):
+        """Consecutive rewards and gap penalties for periods first..last of one day"""
+        cells = self.genome.cells
+        gene_subject = self.problem.gene_subject
+        cost = 0
+        for p in range(max(first - 1, 0), min(last, periods_per_day - 2) + 1):
+            current_gene = cells[start + p]
+            next_gene = cells[start + p + 1]
+            if current_gene and next_gene and gene_subject[current_gene] == gene_subject[next_gene]:
+                cost -= 2
+        for p in range(max(first, 1), min(last, periods_per_day - 2) + 1):
+            if not cells[start + p] and cells[start + p - 1] and cells[start + p + 1]:
+                cost += 1
+        return cost
+
+    def move_delta(self, i, gene):
+        """Penalty change from putting ``gene`` into cell ``i``, without applying it"""
+        cells = self.genome.cells
+        old = cells[i]
+        if old == gene:
+            return 0
+
+        problem = self.problem
+        gene_subject = problem.gene_subject
+        gene_teacher = problem.gene_teacher
+        n_subjects = len(problem.subject_name)
+        slot = i % cells_per_batch
+        day_offset = slot // periods_per_day * n_subjects
+        old_subject = gene_subject[old] if old else -1
+        new_subject = gene_subject[gene] if gene else -1
+        old_teacher = gene_teacher[old] if old else -1
+        new_teacher = gene_teacher[gene] if gene else -1
+        delta = 0
+
+        if old_subject != new_subject:
+            if old:
+                count = self.daily[day_offset + old_subject]
+                limit = problem.max_per_day[old_subject]
+                delta += 50 * (max(count - 1 - limit, 0) - max(count - limit, 0))
+                count = self.weekly[old_subject]
+                limit = problem.max_per_week[old_subject]
+                delta += 200 * (max(count - 1 - limit, 0) - max(count - limit, 0))
+            if gene:
+                count = self.daily[day_offset + new_subject]
+                limit = problem.max_per_day[new_subject]
+                delta += 50 * (max(count + 1 - limit, 0) - max(count - limit, 0))
+                count = self.weekly[new_subject]
+                limit = problem.max_per_week[new_subject]
+                delta += 200 * (max(count + 1 - limit, 0) - max(count - limit, 0))
+
+        if old_teacher != new_teacher:
+            if old and (old_teacher, slot) in self.occupancy.extra:
+                delta -= 100
+            if gene and not self.occupancy.is_free(new_teacher, slot):
+                delta += 100
+
+        # Adjacency terms only change when the cell flips between subjects or free/busy
+        if old_subject != new_subject:
+            start = i - slot % periods_per_day
+            period = slot % periods_per_day
+            before = self._row_cost(start, period - 1, period + 1)
+            cells[i] = gene
+            delta += self._row_cost(start, period - 1, period + 1) - before
+            cells[i] = old
+
+        return delta
+
+    def assign(self, i, gene):
+        """Put ``gene`` into cell ``i``, update the counters and return the penalty change"""
+        cells = self.genome.cells
+        old = cells[i]
+        if old == gene:
+            return 0
+
+        delta = self.move_delta(i, gene)
+        problem = self.problem
+        n_subjects = len(problem.subject_name)
+        slot = i % cells_per_batch
+        day_offset = slot // periods_per_day * n_subjects
+        clashes = self.occupancy.clashes
+        # A count above its limit drops a violation when it falls, one at or above it adds one when it rises
+        if old:
+            s = problem.gene_subject[old]
+            self.hard -= (self.daily[day_offset + s] > problem.max_per_day[s]) + (self.weekly[s] > problem.max_per_week[s])
+            self.daily[day_offset + s] -= 1
+            self.weekly[s] -= 1
+            self.occupancy.remove(problem.gene_teacher[old], slot)
+        if gene:
+            s = problem.gene_subject[gene]
+            self.hard += (self.daily[day_offset + s] >= problem.max_per_day[s]) + (self.weekly[s] >= problem.max_per_week[s])
+            self.daily[day_offset + s] += 1
+            self.weekly[s] += 1
+            self.occupancy.add(problem.gene_teacher[gene], slot)
+        self.hard += self.occupancy.clashes - clashes
+
+        cells[i] = gene
+        self.penalty += delta
+        self.genome.score = self.penalty
+        return delta
+
+    def moves_delta(self, changes):
+        """Penalty change from applying several (cell, gene) changes together, without applying them"""
+        cells = self.genome.cells
+        undo = []
+        delta = 0
+        for i, gene in changes:
+            undo.append((i, cells[i]))
+            delta += self.assign(i, gene)
+        for i, gene in reversed(undo):
+            self.assign(i, gene)
+        return delta
+
+    def verify(self):
+        """Cross-check the running penalty against a full ``fitness`` re-score"""
+        return self.penalty == fitness(self.genome, self.problem)
+
+    def hard_violations(self):
+        """Number of daily-limit, weekly-limit and teacher-clash violations (soft terms excluded)"""
+        return self.hard
+
+    def score_breakdown(self):
+        """``(hard violations, soft penalty)``: the soft part is the penalty minus the hard-constraint terms"""
+        problem = self.problem
+        n_subjects = len(problem.subject_name)
+        violations = self.occupancy.clashes
+        hard_penalty = 100 * self.occupancy.clashes
+        for s in range(n_subjects):
+            excess = max(self.weekly[s] - problem.max_per_week[s], 0)
+            violations += excess
+            hard_penalty += 200 * excess
+            for d in range(len(days)):
+                excess = max(self.daily[d * n_subjects + s] - problem.max_per_day[s], 0)
+                violations += excess
+                hard_penalty += 50 * excess
+        return violations, self.penalty - hard_penalty
+
+
+def hard_violations(genome, problem):
+    """Count hard-constraint violations in a genome"""
+    return FitnessState(genome, problem).hard_violations()
+
+
+def score_breakdown(genome, problem):
+    """``(hard violations, soft penalty)`` of a genome"""
+    return FitnessState(genome, problem).score_breakdown()
 
 
 # Selection function
-def selection(population, subjects, batches):
+def selection(population, problem, rng=random):
     # Tournament selection
     tournament_size = 3
     selected = []
 
     for _ in range(2):  # Select 2 parents
-        tournament = random.sample(population, min(tournament_size, len(population)))
-        winner = min(tournament, key=lambda x: fitness(x, subjects, batches))
+        tournament = rng.sample(population, min(tournament_size, len(population)))
+        winner = min(tournament, key=lambda x: evaluate(x, problem))
         selected.append(winner)
 
     return selected
 
 
 # Crossover function
-def crossover(parent1, parent2, batches):
-    child = {batch: {day: [""] * periods_per_day for day in days} for batch in batches}
+def crossover(parent1, parent2, problem, rng=random):
+    cells = []
+    cells1 = parent1.cells
+    cells2 = parent2.cells
 
-    for batch in batches:
-        # For each batch, randomly choose which days to inherit from which parent
-        for day in days:
-            if random.random() < 0.5:
-                # Inherit full day from parent1
-                child[batch][day] = parent1[batch][day].copy()
-            else:
-                # Inherit full day from parent2
-                child[batch][day] = parent2[batch][day].copy()
+    # For each batch and day, randomly choose which parent to inherit the full day from
+    for start in range(0, problem.n_cells, periods_per_day):
+        source = cells1 if rng.random() < 0.5 else cells2
+        cells.extend(source[start:start + periods_per_day])
 
-    return child
+    return Genome(cells)
 
 
 # Mutation function with respect to constraints
-def mutate(timetable, subjects, batches, mutation_rate):
-    for batch in batches:
-        # Check current subject counts
-        subject_count = {subject: 0 for subject in subjects[batch]}
-
-        # Count current occurrences
-        for day in days:
-            for period in range(periods_per_day):
-                entry = timetable[batch][day][period]
-                if entry:
-                    subject = entry.split(" (")[0]
-                    subject_count[subject] += 1
-
-        # Mutation that respects weekly limits
-        for day in days:
-            for period in range(periods_per_day):
-                if random.random() < mutation_rate:
-                    # 25% chance to clear a period
-                    if random.random() < 0.25:
-                        timetable[batch][day][period] = ""
-                    else:
-                        # Find subjects that haven't reached weekly limit
-                        available_subjects = [
-                            sub for sub in subjects[batch]
-                            if subject_count[sub] < subjects[batch][sub]["constraints"]["max_periods_per_week"]
-                        ]
+def mutate(genome, problem, mutation_rate, state=None, rng=random):
+    """
+    Mutate a genome in place. With a FitnessState for the genome each changed
+    cell is re-scored incrementally and the cached score stays valid.
+    New classes only go to teachers who are free in that slot in every batch;
+    if none of the subject's teachers is, the period is left as it was.
+    """
+    cells = genome.cells
+    occupancy = state.occupancy if state is not None else TeacherOccupancy.from_cells(cells, problem)
+    gene_teacher = problem.gene_teacher
 
-                        if available_subjects:
-                            # Select a subject that hasn't reached its limit
-                            subject = random.choice(available_subjects)
-                            teacher = random.choice(subjects[batch][subject]["teachers"])["name"]
+    def set_cell(i, gene):
+        if state is not None:
+            state.assign(i, gene)
+        else:
+            slot = i % cells_per_batch
+            if cells[i]:
+                occupancy.remove(gene_teacher[cells[i]], slot)
+            if gene:
+                occupancy.add(gene_teacher[gene], slot)
+            cells[i] = gene
+            genome.score = None
 
-                            # If this period already had a subject, decrement its count
-                            if timetable[batch][day][period]:
-                                old_subject = timetable[batch][day][period].split(" (")[0]
-                                subject_count[old_subject] -= 1
+    gene_subject = problem.gene_subject
+    max_per_week = problem.max_per_week
+    subject_count = [0] * len(problem.subject_name)
 
-                            # Assign new subject and increment its count
-                            timetable[batch][day][period] = f"{subject} ({teacher})"
-                            subject_count[subject] += 1
+    for b, batch_subjects in enumerate(problem.batch_subjects):
+        base = b * cells_per_batch
 
-    return timetable
+        # Count current occurrences
+        for i in range(base, base + cells_per_batch):
+            if cells[i]:
+                subject_count[gene_subject[cells[i]]] += 1
 
+        # Mutation that respects weekly limits
+        for i in range(base, base + cells_per_batch):
+            if rng.random() < mutation_rate:
+                # 25% chance to clear a period
+                if rng.random() < 0.25:
+                    if cells[i]:
+                        subject_count[gene_subject[cells[i]]] -= 1
+                    set_cell(i, 0)
+                else:
+                    # Find subjects that haven't reached weekly limit
+                    available_subjects = [
+                        s for s in batch_subjects
+                        if subject_count[s] < max_per_week[s]
+                    ]
+
+                    if available_subjects:
+                        # Select a subject that hasn't reached its limit
+                        s = rng.choice(available_subjects)
+                        # Only teachers free in this slot (the cell's own teacher counts as free)
+                        slot = i - base
+                        current_teacher = gene_teacher[cells[i]] if cells[i] else -1
+                        free = [gene for gene in problem.subject_genes[s]
+                                if gene_teacher[gene] == current_teacher or occupancy.is_free(gene_teacher[gene], slot)]
+                        if not free:
+                            continue
+                        gene = rng.choice(free)
+
+                        # If this period already had a subject, decrement its count
+                        if cells[i]:
+                            subject_count[gene_subject[cells[i]]] -= 1
+
+                        # Assign new subject and increment its count
+                        set_cell(i, gene)
+                        subject_count[s] += 1
+
+    return genome
+
+
+# Final repair pass: weekly limits, teacher clashes, then consecutive fills
+def optimize_timetable(genome, problem, batches=None, rng=random):
+    """
+    Trim subjects over their weekly limit, move clashing classes to a free
+    teacher of the same subject (or free the period), then extend same-subject
+    runs into neighbouring free periods. Every edit goes through FitnessState
+    and fills are only made with a free teacher and when they don't raise the
+    penalty, so the pass never makes a timetable worse. ``batches`` (a set of
+    batch indices) limits the edits to those batches.
+    """
+    cells = genome.cells
+    # Every edit goes through the incremental evaluator, so the result comes out scored
+    state = FitnessState(genome, problem)
+    occupancy = state.occupancy
+    gene_subject = problem.gene_subject
+    gene_teacher = problem.gene_teacher
+    max_per_week = problem.max_per_week
+    subject_count = [0] * len(problem.subject_name)
+
+    def fill(i, s):
+        """Put subject ``s`` into free cell ``i`` if a teacher is free and it doesn't hurt"""
+        slot = i % cells_per_batch
+        free = [gene for gene in problem.subject_genes[s] if occupancy.is_free(gene_teacher[gene], slot)]
+        if free:
+            gene = rng.choice(free)
+            if state.move_delta(i, gene) <= 0:
+                state.assign(i, gene)
+                subject_count[s] += 1
+
+    for b, batch_subjects in enumerate(problem.batch_subjects):
+        if batches is not None and b not in batches:
+            continue
+        base = b * cells_per_batch
 
-# Optimizer to ensure weekly constraints are strictly met
-def optimize_timetable(timetable, subjects, batches):
-    for batch in batches:
         # Count current subject occurrences
-        subject_count = {subject: 0 for subject in subjects[batch]}
-
-        for day in days:
-            for period in range(periods_per_day):
-                entry = timetable[batch][day][period]
-                if entry:
-                    subject = entry.split(" (")[0]
-                    subject_count[subject] += 1
-
-        # Remove excess assignments that exceed weekly limits
-        for subject, count in subject_count.items():
-            max_per_week = subjects[batch][subject]["constraints"]["max_periods_per_week"]
-
-            # If we've exceeded the weekly limit
-            if count > max_per_week:
-                excess = count - max_per_week
-
-                # Find and remove excess periods
-                for day in reversed(days):  # Start from Friday
-                    for period in reversed(range(periods_per_day)):  # Start from last period
-                        entry = timetable[batch][day][period]
-                        if entry and entry.split(" (")[0] == subject:
-                            timetable[batch][day][period] = ""  # Clear the period
-                            excess -= 1
-                            if excess == 0:
-                                break
-                    if excess == 0:
-                        break
+        for i in range(base, base + cells_per_batch):
+            if cells[i]:
+                subject_count[gene_subject[cells[i]]] += 1
+
+        # Remove excess assignments that exceed weekly limits, starting from the last period on Friday
+        for s in batch_subjects:
+            excess = subject_count[s] - max_per_week[s]
+            i = base + cells_per_batch - 1
+            while excess > 0 and i >= base:
+                if cells[i] and gene_subject[cells[i]] == s:
+                    state.assign(i, 0)  # Clear the period
+                    subject_count[s] -= 1
+                    excess -= 1
+                i -= 1
+
+        # Resolve teacher clashes: another teacher of the same subject, else free the period
+        for i in range(base, base + cells_per_batch):
+            gene = cells[i]
+            slot = i - base
+            if gene and occupancy.count(gene_teacher[gene], slot) > 1:
+                free = [other for other in problem.subject_genes[gene_subject[gene]]
+                        if occupancy.is_free(gene_teacher[other], slot)]
+                if free:
+                    state.assign(i, rng.choice(free))
+                else:
+                    state.assign(i, 0)
+                    subject_count[gene_subject[gene]] -= 1
 
         # Try to arrange consecutive periods for the same subject
-        for day in days:
-            # Group consecutive empty periods
-            empty_periods = []
-            start = -1
-
-            for p in range(periods_per_day):
-                if not timetable[batch][day][p]:  # Empty period
-                    if start == -1:
-                        start = p
-                else:  # Non-empty period
-                    if start != -1:
-                        empty_periods.append((start, p - 1))
-                        start = -1
-
-            # Don't forget the last group if it extends to the end
-            if start != -1:
-                empty_periods.append((start, periods_per_day - 1))
-
-            # Now try to place subjects in consecutive periods
-            for subject in subjects[batch]:
+        for d in range(len(days)):
+            start = base + d * periods_per_day
+
+            for s in batch_subjects:
                 # Check if we can still add more periods of this subject
-                current_count = sum(1 for d in days for p in range(periods_per_day)
-                                    if timetable[batch][d][p] and timetable[batch][d][p].split(" (")[0] == subject)
+                if subject_count[s] >= max_per_week[s]:
+                    continue
 
-                max_count = subjects[batch][subject]["constraints"]["max_periods_per_week"]
+                # See if we can place this subject near existing occurrences
+                for p in range(periods_per_day - 1):
+                    if cells[start + p] and gene_subject[cells[start + p]] == s and not cells[start + p + 1]:
+                        # Found subject followed by empty period
+                        fill(start + p + 1, s)
 
-                if current_count < max_count:
-                    # See if we can place this subject near existing occurrences
-                    for p in range(periods_per_day - 1):
-                        if (timetable[batch][day][p] and
-                                timetable[batch][day][p].split(" (")[0] == subject and
-                                not timetable[batch][day][p + 1]):
+                        if subject_count[s] >= max_per_week[s]:
+                            break
 
-                            # Found subject followed by empty period
-                            teacher = random.choice(subjects[batch][subject]["teachers"])["name"]
-                            timetable[batch][day][p + 1] = f"{subject} ({teacher})"
-                            current_count += 1
+                # Also check for empty period followed by this subject
+                if subject_count[s] < max_per_week[s]:
+                    for p in range(1, periods_per_day):
+                        if not cells[start + p - 1] and cells[start + p] and gene_subject[cells[start + p]] == s:
+                            # Found empty period followed by subject
+                            fill(start + p - 1, s)
 
-                            if current_count >= max_count:
+                            if subject_count[s] >= max_per_week[s]:
                                 break
 
-                    # Also check for empty period followed by this subject
-                    if current_count < max_count:
-                        for p in range(1, periods_per_day):
-                            if (not timetable[batch][day][p - 1] and
-                                    timetable[batch][day][p] and
-                                    timetable[batch][day][p].split(" (")[0] == subject):
+    return genome
 
-                                # Found empty period followed by subject
-                                teacher = random.choice(subjects[batch][subject]["teachers"])["name"]
-                                timetable[batch][day][p - 1] = f"{subject} ({teacher})"
-                                current_count += 1
+# Genetic algorithm solver
+def evolve_timetable(problem, population_size=10, generations=100, mutation_rate=0.1, workers=1,
+                     initializer="random", time_limit=None, stall_generations=None,
+                     stop_event=None, on_generation=None, incumbent=None, rng=random, **_):
+    """
+    Run the generational GA and return the best genome found. ``workers`` > 1
+    scores each generation on a process pool. ``on_generation`` is called with
+    a progress dict after every generation (best/mean penalty, hard violations
+    and soft penalty of the best, evals/sec, elapsed time). ``initializer``
+    names the INITIALIZERS entry that builds generation 0.
+
+    The best genome is the one with the fewest hard violations, then the
+    lowest penalty. The run ends when that has no hard violations and a
+    penalty <= 0, after ``generations``, once ``time_limit`` seconds have
+    passed, after ``stall_generations`` generations without improvement, or
+    when ``stop_event`` is set. ``incumbent``, if given, always holds the best
+    genome so far under "genome". Every random draw comes from ``rng``.
+    """
+    pool = FitnessPool(problem, workers) if workers > 1 else None
+
+    hits, misses = fitness_stats["hits"], fitness_stats["misses"]
+    started = time.perf_counter()
+    population = INITIALIZERS.get(initializer, generate_initial_population)(problem, population_size, rng=rng)
+    population_fitness(population, problem, pool)
+    # Generation 0 counts towards the best so far; a constructive start may already be good enough
+    best_genome = min(population, key=lambda x: evaluate(x, problem))
+    best_fitness = initial_fitness = best_genome.score
+    best_hard, best_soft = score_breakdown(best_genome, problem)
+    if incumbent is not None:
+        incumbent["genome"] = best_genome
+    app.logger.debug("Initial population (%s): best penalty %s, %s hard violations",
+                     initializer, initial_fitness, best_hard)
+
+    stalled = 0
+    for generation in range(1, generations + 1):
+        new_population = []
+        for _ in range(population_size):
+            parent1, parent2 = selection(population, problem, rng)
+            child = crossover(parent1, parent2, problem, rng)
+            child = mutate(child, problem, mutation_rate, rng=rng)
+            new_population.append(child)
 
-                                if current_count >= max_count:
-                                    break
+        # Score the whole generation in one batched call; selection then reads the cached scores
+        population = new_population
+        population_fitness(population, problem, pool)
+        count_metric("timetable_generations_total")
+        current_best = min(population, key=lambda x: evaluate(x, problem))
+        current_hard, current_soft = score_breakdown(current_best, problem)
+
+        if (current_hard, current_best.score) < (best_hard, best_fitness):
+            best_genome = current_best
+            best_fitness = current_best.score
+            best_hard, best_soft = current_hard, current_soft
+            stalled = 0
+            if incumbent is not None:
+                incumbent["genome"] = best_genome
+        else:
+            stalled += 1
+
+        elapsed = time.perf_counter() - started
+        if on_generation is not None:
+            on_generation({
+                "generation": generation,
+                "generations": generations,
+                "best_fitness": best_fitness,
+                "initial_fitness": initial_fitness,
+                "mean_fitness": round(sum(x.score for x in population) / len(population), 1),
+                "hard_violations": best_hard,
+                "soft_penalty": best_soft,
+                "stalled_generations": stalled,
+                "evals_per_sec": round((fitness_stats["misses"] - misses) / elapsed, 1) if elapsed else None,
+                "elapsed": round(elapsed, 2),
+                "time_limit": time_limit
+            })
+
+        if best_hard == 0 and best_fitness <= 0:
+            break
 
-    return timetable
+        if time_limit is not None and elapsed >= time_limit:
+            break
 
+        if stall_generations is not None and stalled >= stall_generations:
+            break
 
-# Main GA function
-def create_timetable(population_size=10, generations=100, mutation_rate=0.1):
-    subjects = fetch_subjects_and_teachers()
+        if stop_event is not None and stop_event.is_set():
+            break
+
+    run_hits = fitness_stats["hits"] - hits
+    run_misses = fitness_stats["misses"] - misses
+    # Per-run figures for debugging; /metrics has the process-wide counters
+    app.logger.debug("Fitness cache: %s hits, %s evaluations (%.1f%% hit rate)",
+                     run_hits, run_misses, 100 * run_hits / max(run_hits + run_misses, 1))
+    return best_genome
+
+
+# Simulated annealing solver
+def anneal_timetable(problem, time_limit=10, initializer="random", start_temperature=100.0,
+                     end_temperature=0.5, stop_event=None, on_generation=None, incumbent=None,
+                     initial=None, batches=None, rng=random, **_):
+    """
+    Local search from a single timetable, returning the best genome found.
+
+    Each step proposes one move: reassign a cell to another subject (or free
+    it), swap two cells of the same batch, or hand a cell to another teacher
+    of the same subject. Moves are priced with FitnessState, accepted when
+    they don't make things worse and otherwise with probability
+    exp(-delta / T). T cools geometrically from ``start_temperature`` to
+    ``end_temperature`` over the ``time_limit`` seconds of wall clock, so the
+    schedule stretches to whatever budget is given (10 seconds if none).
+    Progress is reported as percent of the budget used, in the same dict
+    shape as the GA, and the best timetable is ranked like the GA's: fewest
+    hard violations, then lowest penalty. The search ends early once the best
+    has no hard violations and a penalty <= 0; ``incumbent``, if given, always holds
+    the best genome so far under "genome".
+
+    ``initial`` warm-starts the search from a copy of that genome instead of
+    ``initializer``, and ``batches`` (a set of batch indices) restricts the
+    moves to those batches; every other batch is left exactly as it was.
+    Every random draw comes from ``rng``.
+    """
+    time_limit = time_limit or 10
+    if initial is not None:
+        genome = initial.copy()
+        initializer = "warm start"
+    else:
+        genome = INITIALIZERS.get(initializer, generate_initial_population)(problem, 1, rng=rng)[0]
+    state = FitnessState(genome, problem)
+    cells = genome.cells
+    movable = sorted(batches) if batches is not None else list(range(len(problem.batches)))
+    batch_genes = [[gene for s in batch_subjects for gene in problem.subject_genes[s]]
+                   for batch_subjects in problem.batch_subjects]
+    initial_fitness = state.penalty
+    best_cells, best_fitness = cells[:], state.penalty
+    best_hard, best_soft = score_breakdown(Genome(best_cells), problem)
+    if incumbent is not None:
+        incumbent["genome"] = Genome(best_cells, best_fitness)
+    app.logger.debug("Annealing start (%s): penalty %s", initializer, initial_fitness)
+
+    started = time.perf_counter()
+    moves = accepted = 0
+    elapsed = 0.0
+    temperature = start_temperature
+    cooling = end_temperature / start_temperature
+    next_report = 0.0
+
+    def report():
+        on_generation({
+            "generation": min(round(100 * elapsed / time_limit), 100),
+            "generations": 100,
+            "best_fitness": best_fitness,
+            "initial_fitness": initial_fitness,
+            "mean_fitness": state.penalty,
+            "hard_violations": best_hard,
+            "soft_penalty": best_soft,
+            "evals_per_sec": round(moves / elapsed, 1) if elapsed else None,
+            "elapsed": round(elapsed, 2),
+            "time_limit": time_limit,
+            "temperature": round(temperature, 3),
+            "acceptance_rate": round(accepted / moves, 3) if moves else None
+        })
+
+    while movable and not (best_hard == 0 and best_fitness <= 0) and elapsed < time_limit:
+        b = movable[rng.randrange(len(movable))]
+        base = b * cells_per_batch
+        i = base + rng.randrange(cells_per_batch)
+        kind = rng.random()
+        if kind < 0.5 or not cells[i]:
+            # Reassign: another subject/teacher of this batch, or a free period
+            gene = rng.choice(batch_genes[b]) if batch_genes[b] and rng.random() < 0.8 else 0
+            changes = [(i, gene)]
+        elif kind < 0.8:
+            # Swap with another period of the same batch
+            j = base + rng.randrange(cells_per_batch)
+            changes = [(i, cells[j]), (j, cells[i])]
+        else:
+            # Same subject, different teacher
+            changes = [(i, rng.choice(problem.subject_genes[problem.gene_subject[cells[i]]]))]
+
+        moves += 1
+        delta = state.move_delta(*changes[0]) if len(changes) == 1 else state.moves_delta(changes)
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            for cell, gene in changes:
+                state.assign(cell, gene)
+            accepted += 1
+            # Same ranking as the GA: fewest hard violations, then lowest penalty
+            if (state.hard, state.penalty) < (best_hard, best_fitness):
+                best_cells, best_fitness, best_hard = cells[:], state.penalty, state.hard
+                best_soft = None
+
+        # Re-read the clock, cool and re-check the best every few hundred moves rather than on each one
+        if moves % 256 == 0:
+            if best_soft is None:
+                best_soft = score_breakdown(Genome(best_cells), problem)[1]
+                if incumbent is not None:
+                    incumbent["genome"] = Genome(best_cells, best_fitness)
+            elapsed = time.perf_counter() - started
+            temperature = start_temperature * cooling ** min(elapsed / time_limit, 1)
+            if stop_event is not None and stop_event.is_set():
+                break
+            if on_generation is not None and elapsed >= next_report:
+                next_report = elapsed + 0.25
+                report()
+
+    elapsed = time.perf_counter() - started
+    if best_soft is None:
+        best_soft = score_breakdown(Genome(best_cells), problem)[1]
+    if incumbent is not None:
+        incumbent["genome"] = Genome(best_cells, best_fitness)
+    if on_generation is not None:
+        report()
+    count_metric("timetable_annealing_moves_total", moves)
+    app.logger.debug("Annealing: %s moves, %s accepted, best penalty %s in %.1fs",
+                     moves, accepted, best_fitness, elapsed)
+    return Genome(best_cells, best_fitness)
+
+
+# Solvers selectable from the /generate form. Each takes the compiled Problem plus
+# keyword options (ignoring the ones it doesn't use) and returns its best Genome.
+SOLVERS = {
+    "ga": evolve_timetable,
+    "annealing": anneal_timetable,
+}
+
+
+# Main entry point
+def create_timetable(solver="ga", seed=None, subjects=None, snapshot=None, incumbent=None, **options):
+    """
+    Build the problem from the database, run ``solver`` (a SOLVERS key) with
+    ``options`` and return ``(timetable, batches, subjects)``, or
+    ``(None, message, None)`` when there is nothing to schedule. ``seed``
+    seeds a random.Random private to the run, so a seeded run is
+    reproducible even while other runs execute; see the solver functions for the options.
+    Passing ``subjects`` (shaped like fetch_subjects_and_teachers output) or
+    a ``snapshot`` (path or bytes, see dump_snapshot) skips the database.
+    ``incumbent`` is a dict the run fills with "problem", "batches",
+    "subjects" and the solver's best "genome" so far, for peeking at a
+    running solve (see decode_incumbent).
+    """
+    if snapshot is not None or subjects is None:
+        with timed("timetable_phase_duration_seconds", phase="fetch"):
+            subjects = load_snapshot(snapshot) if snapshot is not None else fetch_subjects_and_teachers()
     batches = list(subjects.keys())
 
     if not batches:
-        return None, "No active batches found in the database."
+        return None, "No active batches found in the database.", None
 
-    population = generate_initial_population(subjects, batches, population_size)
-    best_fitness = float('inf')
-    best_timetable = None
+    # The run's own generator: concurrent jobs must not reseed or draw from each other's stream
+    rng = random.Random(seed)
 
-    for generation in range(1, generations + 1):
-        new_population = []
-        for _ in range(population_size):
-            parent1, parent2 = selection(population, subjects, batches)
-            child = crossover(parent1, parent2, batches)
-            child = mutate(child, subjects, batches, mutation_rate)
-            new_population.append(child)
+    # Compile once; the solvers only ever see integer genes
+    with timed("timetable_phase_duration_seconds", phase="compile"):
+        problem = Problem(subjects, batches)
+    if incumbent is not None:
+        incumbent.update(problem=problem, batches=batches, subjects=subjects)
+    solve = SOLVERS.get(solver, evolve_timetable)
+    with timed("timetable_phase_duration_seconds", phase="solve"):
+        best_genome = solve(problem, incumbent=incumbent, rng=rng, **options)
 
-        population = new_population
-        current_best = min(population, key=lambda x: fitness(x, subjects, batches))
-        current_fitness = fitness(current_best, subjects, batches)
+    # Final repair pass: weekly limits and teacher clashes (on a copy, the incumbent may be read meanwhile)
+    with timed("timetable_phase_duration_seconds", phase="optimize"):
+        best_genome = optimize_timetable(best_genome.copy(), problem, rng=rng)
+    if incumbent is not None:
+        incumbent["genome"] = best_genome
 
-        if current_fitness < best_fitness:
-            best_fitness = current_fitness
-            best_timetable = current_best
+    count_metric("timetable_solver_runs_total", solver=solver if solver in SOLVERS else "ga")
+    set_metric("timetable_last_penalty", best_genome.score)
+    set_metric("timetable_last_hard_violations", hard_violations(best_genome, problem))
 
-        if best_fitness <= 0:
-            break
+    # Decode only at the boundary; templates, CSV and the session keep the string cell format
+    with timed("timetable_phase_duration_seconds", phase="decode"):
+        return decode_timetable(best_genome, problem), batches, subjects
 
-    # Final optimization to ensure constraints are strictly met
-    best_timetable = optimize_timetable(best_timetable, subjects, batches)
 
-    return best_timetable, batches, subjects
+def decode_incumbent(incumbent):
+    """``(timetable, batches, subjects)`` for the best genome in an incumbent dict, or None before the first one"""
+    genome = incumbent.get("genome")
+    if genome is None:
+        return None
+    return decode_timetable(genome, incumbent["problem"]), incumbent["batches"], incumbent["subjects"]
+
+
+def repair_timetable(timetable, batches, subjects, touched=(), time_limit=5, seed=None):
+    """
+    Warm-start repair of an existing timetable after its solver input changed.
+
+    ``timetable``/``batches`` are the starting state (see load_saved_timetable)
+    and ``subjects`` the current solver input. Only dirty batches are
+    searched: the ``touched`` ones (e.g. a subject's limits changed), those
+    with a cell that no longer encodes (its subject or teacher assignment is
+    gone), those breaking a limit or in a teacher clash under the new input,
+    and active batches with nothing saved yet. Their free periods are refilled
+    greedily, then they are annealed from there at a low temperature, so they
+    keep as much of their saved layout as the fix allows, and given the usual
+    optimize pass. Every other batch,
+    including ones with no active subjects, is returned exactly as it came.
+    Returns ``(timetable, batches, repaired batches)``.
+    """
+    rng = random.Random(seed)
+    solvable = [batch for batch in batches if batch in subjects]
+    new_batches = [batch for batch in subjects if batch not in timetable]
+    problem = Problem(subjects, solvable + new_batches)
+    genome = encode_timetable(timetable, problem)
+    state = FitnessState(genome, problem)
+
+    dirty = {problem.batch_index[batch] for batch in touched if batch in problem.batch_index}
+    dirty.update(problem.batch_index[batch] for batch in new_batches)
+    decoded = decode_timetable(genome, problem)
+    dirty.update(problem.batch_index[batch] for batch in solvable if decoded[batch] != timetable[batch])
+    n_subjects = len(problem.subject_name)
+    for s in range(n_subjects):
+        if state.weekly[s] > problem.max_per_week[s] or any(
+                state.daily[d * n_subjects + s] > problem.max_per_day[s] for d in range(len(days))):
+            dirty.add(problem.subject_batch[s])
+    clash_slots = set(state.occupancy.extra)
+    if clash_slots:
+        for i, gene in enumerate(genome.cells):
+            if gene and (problem.gene_teacher[gene], i % cells_per_batch) in clash_slots:
+                dirty.add(i // cells_per_batch)
+
+    if dirty:
+        with timed("timetable_phase_duration_seconds", phase="repair"):
+            # Refill free periods first (new batches, cells whose teacher went away) with the
+            # best-priced class still under its weekly count that has a free teacher
+            for b in sorted(dirty):
+                free = [i for i in range(b * cells_per_batch, (b + 1) * cells_per_batch) if not genome.cells[i]]
+                rng.shuffle(free)
+                for i in free:
+                    slot = i % cells_per_batch
+                    priced = [(state.move_delta(i, gene), gene)
+                              for s in problem.batch_subjects[b] if state.weekly[s] < problem.max_per_week[s]
+                              for gene in problem.subject_genes[s]
+                              if state.occupancy.is_free(problem.gene_teacher[gene], slot)]
+                    if priced:
+                        delta, gene = min(priced)
+                        if delta <= 0:
+                            state.assign(i, gene)
+            genome = anneal_timetable(problem, time_limit=time_limit, initial=genome, batches=dirty,
+                                      start_temperature=2.0, end_temperature=0.1, rng=rng)
+            genome = optimize_timetable(genome, problem, batches=dirty, rng=rng)
+        decoded = decode_timetable(genome, problem)
+    count_metric("timetable_repairs_total")
+
+    repaired = [problem.batches[b] for b in sorted(dirty)]
+    repaired_set = set(repaired)
+    result = {batch: decoded[batch] if batch in repaired_set else timetable[batch] for batch in batches}
+    result.update((batch, decoded[batch]) for batch in new_batches)
+    return result, list(batches) + new_batches, repaired
 
 
 # Analyze timetable
@@ -458,27 +1932,10 @@ def analyze_timetable(timetable, subjects, batches):
         if batch not in timetable:
             continue
 
-        # Try to find the corresponding batch in subjects
+        # Both sides are keyed by BatchKey, so the match is one lookup
         subject_batch = batch
-        if batch not in subjects:
-            # Try to find a matching batch with different formatting
-            batch_parts = parse_batch_string(batch)
-            if None in batch_parts:
-                continue  # Skip this batch if parsing fails
-
-            for sb in subjects.keys():
-                sb_parts = parse_batch_string(sb)
-                if None in sb_parts:
-                    continue
-
-                # Compare the components
-                if batch_parts == sb_parts:
-                    subject_batch = sb
-                    break
-
-            # If we still can't find it, skip this batch
-            if subject_batch not in subjects:
-                continue
+        if subject_batch not in subjects:
+            continue
 
         analysis[batch] = {
             "subjects": {},
@@ -541,82 +1998,727 @@ def analyze_timetable(timetable, subjects, batches):
                 print(f"Error analyzing subject {subject}: {str(e)}")
                 # Skip this subject
 
-    return analysis
+    return analysis
+
+
+# Background generation jobs
+class GenerationJob:
+    """
+    One queued or running create_timetable call and what it has produced so far.
+
+    ``stop_event`` ends the GA early; a stopped job keeps its best timetable,
+    a cancelled one (``cancel_requested``) discards it. Every progress or
+    status change bumps ``version`` and wakes ``changed`` for event streams.
+    """
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = 'queued'  # queued, running, done, failed, cancelled
+        self.progress = {"generation": 0, "generations": params.get("generations", 0), "best_fitness": None}
+        self.result = None
+        self.incumbent = {}  # best timetable so far, filled in by create_timetable
+        self.error = None
+        self.stop_event = threading.Event()
+        self.cancel_requested = False
+        self.changed = threading.Condition()
+        self.version = 0
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def _notify(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def update_progress(self, progress):
+        self.progress = progress
+        self._notify()
+
+    def set_status(self, status):
+        self.status = status
+        if self.finished:
+            self.finished_at = time.time()
+        self._notify()
+
+    def wait_for_change(self, seen_version, timeout):
+        """Block until the job changes after ``seen_version`` or ``timeout`` passes"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != seen_version, timeout)
+            return self.version
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "status_url": url_for('job_status', job_id=self.id),
+            "events_url": url_for('job_events', job_id=self.id),
+            "stop_url": url_for('stop_job', job_id=self.id),
+            "cancel_url": url_for('cancel_job', job_id=self.id),
+            "best_url": url_for('job_best', job_id=self.id),
+            "result_url": url_for('job_result', job_id=self.id) if self.status == 'done' else None
+        }
+
+
+jobs = {}
+jobs_lock = threading.Lock()
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+
+def _get_job_executor():
+    """The job thread pool, created once so no more than MAX_CONCURRENT_JOBS runs execute at a time"""
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(
+                max_workers=app.config['MAX_CONCURRENT_JOBS'],
+                thread_name_prefix='timetable-job'
+            )
+        return _job_executor
+
+
+def submit_generation_job(params):
+    """Queue a create_timetable run; returns None when the queue is full"""
+    with jobs_lock:
+        # Forget finished jobs nobody has collected for a while
+        cutoff = time.time() - app.config['JOB_TTL_SECONDS']
+        for job_id in [job_id for job_id, job in jobs.items() if job.finished and job.finished_at < cutoff]:
+            del jobs[job_id]
+
+        pending = sum(1 for job in jobs.values() if not job.finished)
+        if pending >= app.config['MAX_QUEUED_JOBS']:
+            return None
+
+        job = GenerationJob(params)
+        jobs[job.id] = job
+
+    _get_job_executor().submit(_run_generation_job, job)
+    return job
+
+
+def get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+
+def _run_generation_job(job):
+    if job.cancel_requested:
+        job.set_status('cancelled')
+        return
+
+    job.set_status('running')
+    try:
+        # Database helpers expect an application context, which worker threads don't have. Keep it
+        # to the input fetch, so the pooled connection goes back before the minutes-long solve.
+        with app.app_context(), timed("timetable_phase_duration_seconds", phase="fetch"):
+            subjects = fetch_subjects_and_teachers()
+        timetable, batches, subjects = create_timetable(
+            subjects=subjects,
+            stop_event=job.stop_event,
+            on_generation=job.update_progress,
+            incumbent=job.incumbent,
+            **job.params
+        )
+
+        if job.cancel_requested:
+            job.set_status('cancelled')
+        elif timetable is None:
+            job.error = batches
+            job.set_status('failed')
+        else:
+            job.result = (timetable, batches, subjects)
+            job.set_status('done')
+    except Exception as e:
+        print(f"Error in generation job {job.id}: {str(e)}\n{traceback.format_exc()}")
+        job.error = str(e)
+        job.set_status('failed')
+
+
+def parse_seconds(value):
+    """A form field as a finite number of seconds, or None when blank or not a number"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if math.isfinite(seconds) else None
+
+
+def _wants_json():
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+# Routes
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    """Queue a generation job and send the client to its status page (or its id, for API clients)"""
+    seed = request.form.get('seed', '').strip()
+    initializer = request.form.get('initializer', 'random')
+    solver = request.form.get('solver', 'ga')
+    time_limit = parse_seconds(request.form.get('time_limit', ''))
+    stall = request.form.get('stall_generations', '').strip()
+    params = {
+        "solver": solver if solver in SOLVERS else "ga",
+        "time_limit": min(max(time_limit, 1), 600) if time_limit is not None else None,
+        "stall_generations": int(stall) if stall.isdigit() and int(stall) > 0 else None,
+        "population_size": int(request.form.get('population_size', 10)),
+        "generations": int(request.form.get('generations', 100)),
+        "mutation_rate": float(request.form.get('mutation_rate', 0.1)),
+        "workers": min(max(int(request.form.get('workers', 1)), 1), os.cpu_count() or 1),
+        "seed": int(seed) if seed.isdigit() else None,
+        "initializer": initializer if initializer in INITIALIZERS else "random"
+    }
+
+    job = submit_generation_job(params)
+    if job is None:
+        error = "Too many timetable generations are already queued. Please try again in a few minutes."
+        if _wants_json():
+            return jsonify({"error": error}), 503
+        return render_template('index.html', error=error)
+
+    if _wants_json():
+        return jsonify(job.to_dict()), 202
+    return redirect(url_for('job_page', job_id=job.id))
+
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    """Progress page for a generation job"""
+    job = get_job(job_id)
+    if job is None:
+        return render_template('index.html', error="Generation job not found. It may have expired.")
+    return render_template('job.html', job=job.to_dict())
+
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's per-generation progress"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def stream():
+        version = -1
+        while True:
+            seen = job.wait_for_change(version, timeout=15)
+            if seen == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = seen
+            event = "done" if job.finished else "progress"
+            yield f"event: {event}\ndata: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route('/jobs/<job_id>/stop', methods=['POST'])
+def stop_job(job_id):
+    """End a running job now and keep the best timetable found so far"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    job.stop_event.set()
+
+    if _wants_json():
+        return jsonify(job.to_dict())
+    return redirect(url_for('job_page', job_id=job.id))
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    job.cancel_requested = True
+    job.stop_event.set()
+    if job.status == 'queued':
+        job.set_status('cancelled')
+
+    if _wants_json():
+        return jsonify(job.to_dict())
+    return redirect(url_for('index'))
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Render a finished job's timetable"""
+    job = get_job(job_id)
+    if job is None:
+        return render_template('index.html', error="Generation job not found. It may have expired.")
+    if job.status == 'failed':
+        return render_template('index.html', error=job.error)
+    if job.status != 'done':
+        return redirect(url_for('job_page', job_id=job.id))
+
+    return _render_result(*job.result)
+
+
+@app.route('/jobs/<job_id>/best')
+def job_best(job_id):
+    """The best timetable a job has found so far, while it is still running"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    best = decode_incumbent(job.incumbent)
+    if best is None:
+        if _wants_json():
+            return jsonify({"error": "No timetable yet"}), 404
+        return redirect(url_for('job_page', job_id=job.id))
+
+    if _wants_json():
+        timetable, batches, _ = best
+        return jsonify({"progress": job.progress, "batches": [str(batch) for batch in batches],
+                        "timetable": batch_strings(timetable)})
+    return _render_result(*best)
+
+
+def _render_result(timetable, batches, subjects, success_message=None):
+    with timed("timetable_phase_duration_seconds", phase="analyze"):
+        analysis = analyze_timetable(timetable, subjects, batches)
+
+    # Keep the timetable server-side for download; only its id goes in the cookie
+    session['result_id'] = store_timetable(timetable, batches)
+
+    return render_template(
+        'results.html',
+        timetable=timetable,
+        batches=batches,
+        days=days,
+        periods_per_day=periods_per_day,
+        analysis=analysis,
+        success_message=success_message
+    )
+
+
+@app.route('/metrics')
+def metrics():
+    """Request, database, rendering and solver metrics in Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/db_pool_stats')
+def db_pool_stats_view():
+    """Connection pool usage as JSON"""
+    with _db_pool_lock:
+        stats = dict(db_pool_stats)
+    stats["pool_size"] = app.config['DB_POOL_SIZE']
+    return jsonify(stats)
+
+
+@app.route('/snapshot')
+def download_snapshot():
+    """Download the current problem instance as an offline snapshot file"""
+    subjects = fetch_subjects_and_teachers()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return send_file(
+        io.BytesIO(dump_snapshot(subjects)),
+        mimetype='application/octet-stream',
+        as_attachment=True,
+        download_name=f'timetable_problem_{timestamp}.ttsnap'
+    )
+
+
+# CSV exports
+CSV_VIEWS = ("batch", "teacher", "long")
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def _split_entry(entry):
+    """(subject, teacher) of a timetable cell: an editor dict, a "Subject (Teacher)" string, or empty"""
+    if not entry:
+        return None, None
+    if isinstance(entry, dict):  # editor cells carry ids alongside the names
+        return entry['subject_name'], entry['teacher_name']
+    if " (" in entry and entry.endswith(")"):
+        subject, teacher = entry.rsplit(" (", 1)
+        return subject, teacher[:-1]
+    return entry, ""
+
+
+def result_cells(timetable, batches):
+    """Cells of a generated or edited result as (batch, day, period, subject, teacher); free cells have no subject"""
+    for batch in batches:
+        for day in days:
+            for period, entry in enumerate(timetable[batch][day]):
+                subject, teacher = _split_entry(entry)
+                yield batch, day, period, subject, teacher
+
+
+def saved_cells(cursor, fetch_size=1000):
+    """
+    Cells of the saved timetable, read from an executed SAVED_CELLS_QUERY a
+    chunk at a time (on an unbuffered cursor, rows then also arrive from the
+    server a chunk at a time). Free periods are not stored, so only filled
+    cells come out.
+    """
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            return
+        for course_id, year, semester, batch_id, day, period, subject, teacher in rows:
+            yield BatchKey.of(course_id, year, semester, batch_id), day, int(period), subject, teacher
+
+
+SAVED_CELLS_QUERY = """
+    SELECT ta.course_id, ta.year, ta.semester, ta.batch_id, ta.day, ta.period,
+           cs.subject_name, CONCAT(td.first_name, ' ', td.last_name) as teacher_name
+    FROM timetable_assignments ta
+    JOIN course_subjects cs ON ta.subject_id = cs.id
+    JOIN teacher_details td ON ta.teacher_id = td.id
+    ORDER BY ta.course_id, ta.year, ta.semester, ta.batch_id, ta.day_ordinal, ta.period
+"""
+
+
+def _grid_header():
+    header = ["Day"]
+    for i in range(periods_per_day):
+        if i == 3:  # Add lunch break after period 3
+            header.append("Lunch")
+        header.append(f"Period {i + 1}")
+    return header
+
+
+def _grid_rows(title, grid):
+    """CSV rows of one weekly grid: {(day, period): text}, FREE where there is nothing"""
+    yield [title]
+    yield _grid_header()
+    for day in days:
+        row = [day]
+        for i in range(periods_per_day):
+            if i == 3:
+                row.append("LUNCH")
+            row.append(grid.get((day, i)) or "FREE")
+        yield row
+    # Add empty row between grids
+    yield []
+
+
+def batch_csv_rows(cells):
+    """One grid per batch; ``cells`` must come grouped by batch, so only one batch is held at a time"""
+    current, grid = None, {}
+    for batch, day, period, subject, teacher in cells:
+        if batch != current:
+            if current is not None:
+                yield from _grid_rows(f"Timetable for {current}", grid)
+            current, grid = batch, {}
+        if subject:
+            grid[(day, period)] = f"{subject} ({teacher})"
+    if current is not None:
+        yield from _grid_rows(f"Timetable for {current}", grid)
+
+
+def teacher_csv_rows(cells):
+    """One grid per teacher, cells showing "Subject [batch]"; clashing classes share a cell"""
+    grids = {}
+    for batch, day, period, subject, teacher in cells:
+        if subject:
+            grid = grids.setdefault(teacher, {})
+            text = f"{subject} [{batch}]"
+            grid[(day, period)] = f"{grid[(day, period)]} / {text}" if (day, period) in grid else text
+    for teacher in sorted(grids):
+        yield from _grid_rows(f"Timetable for {teacher}", grids[teacher])
+
+
+def long_csv_rows(cells):
+    """One row per scheduled class (tidy format)"""
+    yield ["Batch", "Day", "Period", "Subject", "Teacher"]
+    for batch, day, period, subject, teacher in cells:
+        if subject:
+            yield [str(batch), day, period + 1, subject, teacher]
+
+
+CSV_ROW_BUILDERS = {"batch": batch_csv_rows, "teacher": teacher_csv_rows, "long": long_csv_rows}
+
+
+class _CsvLine:
+    """Write target for csv.writer that hands each formatted line back instead of storing it"""
+
+    def write(self, line):
+        return line
+
+
+def stream_csv(rows, compress=False):
+    """Yield CSV ``rows`` as UTF-8 chunks of about CSV_CHUNK_SIZE, gzip-compressed if asked"""
+    writer = csv.writer(_CsvLine())
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip container
+    lines, size = [], 0
+    for row in rows:
+        line = writer.writerow(row)
+        lines.append(line)
+        size += len(line)
+        if size >= CSV_CHUNK_SIZE:
+            chunk = "".join(lines).encode('utf-8')
+            lines, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = "".join(lines).encode('utf-8')
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+@app.route('/download_csv')
+def download_csv():
+    """
+    Stream the timetable as CSV.
 
+    ``source`` is ``result`` (the timetable in this session, default) or
+    ``saved`` (timetable_assignments). ``view`` is ``batch`` (one grid per
+    batch, default), ``teacher`` (one grid per teacher) or ``long`` (one row
+    per class). ``gzip=1`` compresses the download.
+    """
+    view = request.args.get('view', 'batch')
+    view = view if view in CSV_VIEWS else 'batch'
+    source = request.args.get('source', 'result')
+    compress = request.args.get('gzip', '') in ('1', 'true', 'on')
 
-# Routes
-@app.route('/')
-def index():
-    return render_template('index.html')
+    if source == 'saved':
+        db = get_db_connection()
+        ensure_schema(db)  # the query sorts on day_ordinal
+        # The pool's cursors are buffered, which would pull the whole result set in before the first
+        # row goes out; nothing else uses the connection while this streams
+        cursor = db.cursor(buffered=False)
+        cursor.execute(SAVED_CELLS_QUERY)
 
+        def read_saved():
+            try:
+                yield from saved_cells(cursor)
+            finally:
+                # A client that hangs up early leaves rows behind, which the pooled connection can't keep
+                db.consume_results()
+                cursor.close()
+        cells = read_saved()
+    else:
+        result = load_timetable(session.get('result_id'))
+        if not result or not result[1]:
+            return redirect(url_for('index'))
+        cells = result_cells(*result)
 
-@app.route('/generate', methods=['POST'])
-def generate():
-    population_size = int(request.form.get('population_size', 10))
-    generations = int(request.form.get('generations', 100))
-    mutation_rate = float(request.form.get('mutation_rate', 0.1))
-
-    timetable, batches, subjects = create_timetable(
-        population_size=population_size,
-        generations=generations,
-        mutation_rate=mutation_rate
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"timetable_{view}_{timestamp}.csv" + (".gz" if compress else "")
+    return Response(
+        stream_with_context(stream_csv(CSV_ROW_BUILDERS[view](cells), compress)),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-    if timetable is None:
-        return render_template('index.html', error=batches)
 
-    analysis = analyze_timetable(timetable, subjects, batches)
+# Teacher timetables
+class TeacherIndex:
+    """
+    Inverted timetable index: teacher -> (day, period) -> [(batch, subject), ...].
 
-    # Store timetable in session for download
-    session['timetable'] = json.dumps(timetable)
-    session['batches'] = json.dumps(batches)
+    Built once from a cell stream (result_cells or saved_cells) and kept
+    current cell by cell with set_cell, so a teacher's week and workload are
+    read from their own slots alone, however many batches there are. More
+    than one class in a slot is a clash.
+    """
 
-    return render_template(
-        'results.html',
-        timetable=timetable,
-        batches=batches,
-        days=days,
-        periods_per_day=periods_per_day,
-        analysis=analysis
-    )
+    def __init__(self):
+        self.slots = {}
+        self.cells = {}  # (batch, day, period) -> (subject, teacher), to undo a cell's old entry
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_cells(cls, cells):
+        index = cls()
+        for batch, day, period, subject, teacher in cells:
+            if subject:
+                index.set_cell(batch, day, period, subject, teacher)
+        return index
+
+    def set_cell(self, batch, day, period, subject=None, teacher=None):
+        """Make a batch's cell hold ``subject`` taught by ``teacher``, or nothing"""
+        with self.lock:
+            old = self.cells.pop((batch, day, period), None)
+            if old:
+                old_subject, old_teacher = old
+                teacher_slots = self.slots[old_teacher]
+                classes = teacher_slots[(day, period)]
+                classes.remove((batch, old_subject))
+                if not classes:
+                    del teacher_slots[(day, period)]
+                    if not teacher_slots:
+                        del self.slots[old_teacher]
+            if subject:
+                self.cells[(batch, day, period)] = (subject, teacher)
+                self.slots.setdefault(teacher, {}).setdefault((day, period), []).append((batch, subject))
+
+    def teachers(self):
+        with self.lock:
+            return sorted(self.slots)
+
+    def week(self, teacher):
+        """{day: [classes per period]}, each a list of (batch, subject)"""
+        grid = {day: [[] for _ in range(periods_per_day)] for day in days}
+        with self.lock:
+            for (day, period), classes in self.slots.get(teacher, {}).items():
+                if day in grid and 0 <= period < periods_per_day:
+                    grid[day][period] = list(classes)
+        return grid
+
+    def workload(self, teacher):
+        """Teaching periods per day, free periods per day, totals and clash count for one teacher"""
+        daily = {day: 0 for day in days}
+        clashes = 0
+        with self.lock:
+            for (day, period), classes in self.slots.get(teacher, {}).items():
+                if day in daily:
+                    daily[day] += 1
+                clashes += len(classes) - 1
+        return {
+            "daily": daily,
+            "free": {day: periods_per_day - load for day, load in daily.items()},
+            "total": sum(daily.values()),
+            "busiest_day": max(daily.values()),
+            "clashes": clashes
+        }
 
 
-@app.route('/download_csv')
-def download_csv():
-    timetable = json.loads(session.get('timetable', '{}'))
-    batches = json.loads(session.get('batches', '[]'))
+SAVED_TEACHER_INDEX = 'saved_teacher_index'
 
-    if not timetable or not batches:
-        return redirect(url_for('index'))
 
-    # Create in-memory CSV file
-    output = io.StringIO()
-    writer = csv.writer(output)
+def get_teacher_index(source):
+    """
+    The TeacherIndex of the saved timetable (``source='saved'``) or of the
+    session's result, built on first use and cached. The saved index is
+    stamped with fetch_timetable_version and rebuilt only when a save it has
+    not been told about (see update_saved_teacher_index) changed the stamp.
+    Returns None when there is no result in the session.
+    """
+    if source == 'saved':
+        db = get_db_connection()
+        ensure_schema(db)  # the stamp reads timetable_batch_versions
+        cursor = db.cursor()
+        try:
+            def build():
+                cursor.execute(SAVED_CELLS_QUERY)
+                return TeacherIndex.from_cells(saved_cells(cursor))
+            return _cached(SAVED_TEACHER_INDEX, build, stamp=fetch_timetable_version(cursor))
+        finally:
+            cursor.close()
 
-    for batch in batches:
-        writer.writerow([f"Timetable for {batch}"])
-        writer.writerow(
-            ["Day", "Period 1", "Period 2", "Period 3", "Lunch", "Period 4", "Period 5", "Period 6", "Period 7"])
+    result_id = session.get('result_id')
 
-        for day in days:
-            row = [day]
-            for i in range(periods_per_day):
-                if i == 3:  # Add lunch break after period 3
-                    row.append("LUNCH")
-                row.append(timetable[batch][day][i] if timetable[batch][day][i] else "FREE")
-            writer.writerow(row)
+    def build_from_result():
+        result = load_timetable(result_id)
+        if not result or not result[1]:
+            return None
+        return TeacherIndex.from_cells(result_cells(*result))
+    return _cached('result_teacher_index', build_from_result, stamp=result_id)
 
-        # Add empty row between batches
-        writer.writerow([])
 
-    output.seek(0)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'timetable_{timestamp}.csv'
-    )
+def update_saved_teacher_index(cursor, applied, new_batches):
+    """
+    Apply committed editor changes to the cached saved-timetable index in place.
+
+    ``applied`` maps the BatchKey of each batch whose version was bumped to its
+    {(day, period): (subject_id, teacher_id) or None} changes; ``new_batches``
+    counts the batches saved for the first time. The cached stamp moves by
+    exactly what the save added, so it still matches the database only if
+    the index was current before and nobody else saved in between; otherwise
+    the next read rebuilds it.
+    """
+    with _data_cache_lock:
+        if SAVED_TEACHER_INDEX not in _data_cache:
+            return
+
+    # Names of the subjects and teachers the changes refer to
+    subject_ids = {value[0] for changes in applied.values() for value in changes.values() if value}
+    teacher_ids = {value[1] for changes in applied.values() for value in changes.values() if value}
+    subject_names, teacher_names = {}, {}
+    if subject_ids:
+        cursor.execute(f"SELECT id, subject_name FROM course_subjects WHERE id IN ({', '.join(['%s'] * len(subject_ids))})",
+                       list(subject_ids))
+        subject_names = {int(row[0]): row[1] for row in cursor.fetchall()}
+        cursor.execute(f"""
+        SELECT id, CONCAT(first_name, ' ', last_name) FROM teacher_details
+        WHERE id IN ({', '.join(['%s'] * len(teacher_ids))})
+        """, list(teacher_ids))
+        teacher_names = {int(row[0]): row[1] for row in cursor.fetchall()}
+
+    with _data_cache_lock:
+        entry = _data_cache.get(SAVED_TEACHER_INDEX)
+        if entry is None:
+            return
+        version, created, index, (count, total) = entry
+        for batch, changes in applied.items():
+            for (day, period), value in changes.items():
+                if value is None:
+                    index.set_cell(batch, day, period)
+                else:
+                    index.set_cell(batch, day, period, subject_names.get(value[0]), teacher_names.get(value[1]))
+        _data_cache[SAVED_TEACHER_INDEX] = (version, created, index, (count + new_batches, total + len(applied)))
+
+
+@app.route('/teachers')
+def teacher_workloads():
+    """Workload of every teacher in the saved timetable or, with ``source=result``, the session's result"""
+    source = 'result' if request.args.get('source') == 'result' else 'saved'
+    try:
+        index = get_teacher_index(source)
+        if index is None:
+            return redirect(url_for('index'))
+        workloads = [(teacher, index.workload(teacher)) for teacher in index.teachers()]
+        return render_template('teachers.html',
+                               workloads=workloads,
+                               source=source,
+                               days=days,
+                               periods_per_day=periods_per_day)
+    except Exception as e:
+        error_msg = f"Error loading teacher workloads: {str(e)}\n{traceback.format_exc()}"
+        print(error_msg)
+        return render_template('index.html', error=f"Error loading teacher workloads: {str(e)}")
+
+
+@app.route('/teachers/<path:teacher>')
+def teacher_timetable(teacher):
+    """One teacher's week and workload, read from the teacher index"""
+    source = 'result' if request.args.get('source') == 'result' else 'saved'
+    try:
+        index = get_teacher_index(source)
+        if index is None:
+            return redirect(url_for('index'))
+        return render_template('teacher_timetable.html',
+                               teacher=teacher,
+                               week=index.week(teacher),
+                               workload=index.workload(teacher),
+                               source=source,
+                               days=days,
+                               periods_per_day=periods_per_day)
+    except Exception as e:
+        error_msg = f"Error loading teacher timetable: {str(e)}\n{traceback.format_exc()}"
+        print(error_msg)
+        return render_template('index.html', error=f"Error loading teacher timetable: {str(e)}")
 
 
 def fetch_all_subjects():
@@ -636,7 +2738,6 @@ def fetch_all_subjects():
     subjects = cursor.fetchall()
 
     cursor.close()
-    db.close()
     return subjects
 
 
@@ -665,7 +2766,6 @@ def fetch_subject_periods():
         }
 
     cursor.close()
-    db.close()
     return periods_dict
 
 
@@ -697,6 +2797,7 @@ def save_subject_periods(subject_id, max_periods_per_day, max_periods_per_week):
             cursor.execute(insert_query, (subject_id, max_periods_per_day, max_periods_per_week))
 
         db.commit()
+        invalidate_data_cache()
         success = True
     except Exception as e:
         db.rollback()
@@ -704,11 +2805,211 @@ def save_subject_periods(subject_id, max_periods_per_day, max_periods_per_week):
         success = False
     finally:
         cursor.close()
-        db.close()
 
     return success
 
 
+def fetch_assignment_ids(cursor, batches):
+    """
+    Resolve subject and teacher ids for saving timetables with two set-based queries.
+
+    ``batches`` is a list of BatchKeys. Returns
+    ({(batch, subject_name): subject_id}, {teacher_name: teacher_id}).
+    """
+    subject_ids = {}
+    if batches:
+        placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(batches))
+        cursor.execute(f"""
+        SELECT cs.id, cs.subject_name, cs.course_id, cs.year, cs.semester, cs.batch_id
+        FROM course_subjects cs
+        WHERE cs.is_active = 1 AND (cs.course_id, cs.year, cs.semester, cs.batch_id) IN ({placeholders})
+        """, [part for batch in batches for part in batch])
+        for subject_id, subject_name, course_id, year, semester, batch_id in cursor.fetchall():
+            key = (BatchKey.of(course_id, year, semester, batch_id), subject_name)
+            subject_ids.setdefault(key, subject_id)
+
+    teacher_ids = {}
+    cursor.execute("SELECT td.id, td.first_name, td.last_name FROM teacher_details td ORDER BY td.id")
+    for teacher_id, first_name, last_name in cursor.fetchall():
+        teacher_ids.setdefault(f"{first_name} {last_name}", teacher_id)
+
+    return subject_ids, teacher_ids
+
+
+def insert_assignments(cursor, rows, chunk_size=1000):
+    """Write (course_id, year, semester, batch_id, day, period, subject_id, teacher_id) rows as multi-row INSERTs"""
+    insert_query = """
+    INSERT INTO timetable_assignments 
+    (course_id, year, semester, batch_id, day, day_ordinal, period, subject_id, teacher_id, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    """
+    rows = [row[:5] + (DAY_ORDINALS.get(row[4], -1),) + row[5:] for row in rows]
+    for start in range(0, len(rows), chunk_size):
+        # executemany folds an INSERT ... VALUES into a single multi-row statement
+        cursor.executemany(insert_query, rows[start:start + chunk_size])
+
+
+# Versioned schema migrations, applied in order and recorded in schema_migrations
+SCHEMA_MIGRATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Per-batch timetable versions for optimistic concurrency
+BATCH_VERSIONS_DDL = """
+CREATE TABLE IF NOT EXISTS timetable_batch_versions (
+    course_id VARCHAR(50) NOT NULL,
+    year VARCHAR(50) NOT NULL,
+    semester VARCHAR(50) NOT NULL,
+    batch_id VARCHAR(50) NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (course_id, year, semester, batch_id)
+)
+"""
+
+SCHEMA_MIGRATIONS = [
+    (1, "Per-batch timetable versions", [BATCH_VERSIONS_DDL]),
+    (2, "Composite indexes for per-batch reads and writes", [
+        # Per-batch filters, DISTINCT batch lists and (day, period) deletes
+        "CREATE INDEX idx_ta_batch_slot ON timetable_assignments (course_id, year, semester, batch_id, day, period)",
+        # Solver input and editor options by batch
+        "CREATE INDEX idx_cs_batch ON course_subjects (course_id, year, semester, batch_id, is_active)",
+        "CREATE INDEX idx_sa_subject_teacher ON subject_assignments (course_subject_id, teacher_id)",
+    ]),
+    (3, "Integer day ordinal so reads sort without FIELD()", [
+        "ALTER TABLE timetable_assignments ADD COLUMN day_ordinal TINYINT NOT NULL DEFAULT 0",
+        "UPDATE timetable_assignments SET day_ordinal = FIELD(day, "
+        + ", ".join(f"'{day}'" for day in days) + ") - 1",
+        "CREATE INDEX idx_ta_order ON timetable_assignments (year, semester, batch_id, day_ordinal, period)",
+    ]),
+    (4, "Lead the timetable read-order index with course_id, like every batch key", [
+        "DROP INDEX idx_ta_order ON timetable_assignments",
+        "CREATE INDEX idx_ta_order ON timetable_assignments "
+        "(course_id, year, semester, batch_id, day_ordinal, period)",
+    ]),
+]
+# MySQL errors that mean a statement's effect is already there (duplicate column / index, index already dropped)
+_ALREADY_APPLIED_ERRORS = {1060, 1061, 1091}
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def migrate_schema(db):
+    """Apply and commit every migration newer than the recorded schema version; returns the versions applied"""
+    cursor = db.cursor()
+    try:
+        cursor.execute(SCHEMA_MIGRATIONS_DDL)
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+
+        applied = []
+        for version, description, statements in SCHEMA_MIGRATIONS:
+            if version in done:
+                continue
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except mysql.connector.Error as e:
+                    if e.errno not in _ALREADY_APPLIED_ERRORS:
+                        raise
+            cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                           (version, description))
+            db.commit()
+            applied.append(version)
+            print(f"Applied schema migration {version}: {description}")
+        return applied
+    finally:
+        cursor.close()
+
+
+def ensure_schema(db):
+    """Bring the schema up to date on first use (commits, so call it before any writes)"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            migrate_schema(db)
+            _schema_ready = True
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = migrate_schema(get_db_connection())
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+
+def fetch_batch_versions(cursor):
+    """{BatchKey: version} for every batch that has been saved"""
+    cursor.execute("SELECT course_id, year, semester, batch_id, version FROM timetable_batch_versions")
+    return {BatchKey.of(*row[:4]): row[4] for row in cursor.fetchall()}
+
+
+def lock_batch_version(cursor, batch):
+    """Lock a batch's version row for the current transaction and return its version (0 if never saved)"""
+    cursor.execute("""
+    SELECT version FROM timetable_batch_versions
+    WHERE course_id = %s AND year = %s AND semester = %s AND batch_id = %s
+    FOR UPDATE
+    """, batch)
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def bump_batch_version(cursor, batch):
+    cursor.execute("""
+    INSERT INTO timetable_batch_versions (course_id, year, semester, batch_id, version)
+    VALUES (%s, %s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+    """, batch)
+
+
+def apply_batch_changes(cursor, batch, changes):
+    """
+    Bring one batch's stored assignments in line with ``changes``.
+
+    ``changes`` maps (day, period) to (subject_id, teacher_id), or to None for
+    a free period. Cells that already hold that value are left alone; the
+    rest are removed with one DELETE and rewritten with one multi-row INSERT.
+    Returns the number of cells that changed.
+    """
+    cursor.execute("""
+    SELECT day, period, subject_id, teacher_id FROM timetable_assignments
+    WHERE course_id = %s AND year = %s AND semester = %s AND batch_id = %s
+    FOR UPDATE
+    """, batch)
+    stored = {}
+    for day, period, subject_id, teacher_id in cursor.fetchall():
+        stored.setdefault((day, int(period)), []).append((int(subject_id), int(teacher_id)))
+
+    deletes = []
+    rows = []
+    for (day, period), value in changes.items():
+        current = stored.get((day, period), [])
+        if (value is None and not current) or current == [value]:
+            continue
+        if current:
+            deletes.append((day, period))
+        if value is not None:
+            rows.append(tuple(batch) + (day, period) + value)
+
+    if deletes:
+        placeholders = ", ".join(["(%s, %s)"] * len(deletes))
+        cursor.execute(f"""
+        DELETE FROM timetable_assignments
+        WHERE course_id = %s AND year = %s AND semester = %s AND batch_id = %s
+        AND (day, period) IN ({placeholders})
+        """, list(batch) + [part for cell in deletes for part in cell])
+    insert_assignments(cursor, rows)
+
+    return len(set(deletes) | {(row[4], row[5]) for row in rows})
+
+
 # Modify your existing fetch_subjects_and_teachers function to use the configured periods
 
 
@@ -724,7 +3025,7 @@ def configure_periods():
     # Group subjects by batch
     batches = {}
     for subject in subjects:
-        batch_key = f"{subject['course_id']},{subject['year']}, {subject['semester']}, {subject['batch_id']}"
+        batch_key = BatchKey.of(subject['course_id'], subject['year'], subject['semester'], subject['batch_id'])
 
         if batch_key not in batches:
             batches[batch_key] = []
@@ -739,7 +3040,8 @@ def configure_periods():
 
         batches[batch_key].append(subject)
 
-    return render_template('configure_periods.html', batches=batches, course_map=course_map)
+    return render_template('configure_periods.html', batches=batches, course_map=course_map,
+                           repair_batches=session.get('repair_batches', []))
 
 
 @app.route('/save_periods', methods=['POST'])
@@ -747,6 +3049,10 @@ def save_periods():
     """Save the period configuration for subjects"""
     if request.method == 'POST':
         processed_subjects = set()
+        changed_subjects = set()
+        # Limits before this save, to tell which batches a repair has to revisit
+        previous = fetch_subject_periods()
+        touched = set(session.get('repair_batches', []))
 
         for key, value in request.form.items():
             if key.startswith('subject_'):
@@ -778,11 +3084,18 @@ def save_periods():
                                     max_week = 35
 
                                 # Save to database
+                                before = previous.get(subject_id, {'max_periods_per_day': 1, 'max_periods_per_week': 3})
+                                if (before['max_periods_per_day'], before['max_periods_per_week']) != (max_day, max_week):
+                                    changed_subjects.add(subject_id)
                                 save_subject_periods(subject_id, max_day, max_week)
                             except ValueError:
                                 # Handle invalid input
                                 continue
 
+        if changed_subjects:
+            touched.update(str(BatchKey.of(subject['course_id'], subject['year'], subject['semester'], subject['batch_id']))
+                           for subject in fetch_all_subjects() if subject['id'] in changed_subjects)
+            session['repair_batches'] = sorted(touched)
         return redirect(url_for('configure_periods', success=True))
 
 
@@ -801,165 +3114,155 @@ def save_timetable():
             # Connect to the database
             db = get_db_connection()
             cursor = db.cursor()
+            ensure_schema(db)
+
+            # Parse every posted batch string once
+            batch_keys = {}
+            skipped = {"invalid batch": 0, "invalid format": 0, "unknown subject": 0, "unknown teacher": 0}
+            for name in timetable_data:
+                batch = BatchKey.parse(name)
+                if batch is None:
+                    skipped["invalid batch"] += 1
+                    continue
+                batch_keys[name] = batch
 
-            # First, clear existing timetable entries
-            clear_query = "DELETE FROM timetable_assignments WHERE 1=1"
-            cursor.execute(clear_query)
-
-            # Insert the new timetable data
-            for batch, batch_data in timetable_data.items():
-                # Parse batch information
-                batch_parts = parse_batch_string(batch)
-                if None in batch_parts:
-                    continue  # Skip this batch if parsing fails
-
-                course_id, year, semester, batch_id = batch_parts
+            # Resolve all subject and teacher ids up front
+            subject_ids, teacher_ids = fetch_assignment_ids(cursor, list(batch_keys.values()))
 
-                for day, day_data in batch_data.items():
+            # Desired state of every cell, per batch; empty cells become free periods
+            batch_changes = {}
+            for name, batch in batch_keys.items():
+                changes = batch_changes.setdefault(batch, {})
+                for day, day_data in timetable_data[name].items():
                     for period, entry in enumerate(day_data):
-                        if entry:  # Only save non-empty entries
-                            try:
-                                # Split the subject and teacher
-                                if " (" in entry and ")" in entry:
-                                    subject, teacher = entry.rsplit(' (', 1)
-                                    teacher = teacher.rstrip(')')
-                                else:
-                                    # Handle case where format is not as expected
-                                    print(f"Skipping entry with invalid format: {entry}")
-                                    continue
-
-                                # Get subject_id and teacher_id from the database
-                                subject_query = """
-                                SELECT cs.id 
-                                FROM course_subjects cs 
-                                WHERE cs.subject_name = %s AND cs.course_id = %s AND cs.year = %s 
-                                AND cs.semester = %s AND cs.batch_id = %s AND cs.is_active = 1
-                                """
-                                cursor.execute(subject_query, (subject, course_id, year, semester, batch_id))
-                                subject_result = cursor.fetchone()
-
-                                if not subject_result:
-                                    print(f"Subject not found: {subject} for batch {batch}")
-                                    continue  # Skip if subject not found
-
-                                subject_id = subject_result[0]
-
-                                teacher_query = """
-                                SELECT td.id 
-                                FROM teacher_details td 
-                                WHERE CONCAT(td.first_name, ' ', td.last_name) = %s
-                                """
-                                cursor.execute(teacher_query, (teacher,))
-                                teacher_result = cursor.fetchone()
-
-                                if not teacher_result:
-                                    print(f"Teacher not found: {teacher}")
-                                    continue  # Skip if teacher not found
-
-                                teacher_id = teacher_result[0]
-
-                                # Save the assignment
-                                insert_query = """
-                                INSERT INTO timetable_assignments 
-                                (course_id, year, semester, batch_id, day, period, subject_id, teacher_id, created_at)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                                """
-                                cursor.execute(insert_query, (
-                                    course_id, year, semester, batch_id, day, period, subject_id, teacher_id
-                                ))
-                            except Exception as e:
-                                print(f"Error processing entry {entry}: {str(e)}")
-                                continue  # Skip this entry and continue with others
-
-            # Commit the changes
-            db.commit()
-            cursor.close()
-            db.close()
+                        changes[(day, period)] = None
+                        if not entry:
+                            continue
+
+                        # Split the subject and teacher
+                        if " (" not in entry or ")" not in entry:
+                            skipped["invalid format"] += 1
+                            continue
+                        subject, teacher = entry.rsplit(' (', 1)
+                        teacher = teacher.rstrip(')')
+
+                        subject_id = subject_ids.get((batch, subject))
+                        if subject_id is None:
+                            skipped["unknown subject"] += 1
+                            continue
+                        teacher_id = teacher_ids.get(teacher)
+                        if teacher_id is None:
+                            skipped["unknown teacher"] += 1
+                            continue
+
+                        changes[(day, period)] = (subject_id, teacher_id)
+
+            # Replace the stored timetable in one transaction, writing only the cells that differ
+            saved = sum(1 for changes in batch_changes.values() for value in changes.values() if value)
+            changed = 0
+            try:
+                cursor.execute("SELECT DISTINCT course_id, year, semester, batch_id FROM timetable_assignments")
+                stale_batches = {BatchKey.of(*row) for row in cursor.fetchall()} - set(batch_changes)
+                for batch in stale_batches:
+                    # Batches missing from the new timetable are cleared, as a full save always did
+                    cursor.execute("""
+                    DELETE FROM timetable_assignments
+                    WHERE course_id = %s AND year = %s AND semester = %s AND batch_id = %s
+                    """, batch)
+                    bump_batch_version(cursor, batch)
+
+                for batch, changes in batch_changes.items():
+                    lock_batch_version(cursor, batch)
+                    batch_changed = apply_batch_changes(cursor, batch, changes)
+                    if batch_changed:
+                        bump_batch_version(cursor, batch)
+                    changed += batch_changed
+                db.commit()
+                # The whole timetable was just saved, so any limit changes awaiting a repair are settled
+                session.pop('repair_batches', None)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                cursor.close()
 
             # Store success message in session
-            session['success_message'] = "Timetable successfully saved!"
+            message = f"Timetable successfully saved! {saved} entries saved ({changed} cells changed)."
+            skipped_total = sum(skipped.values())
+            if skipped_total:
+                reasons = ", ".join(f"{count} {reason}" for reason, count in skipped.items() if count)
+                message += f" {skipped_total} skipped ({reasons})."
+                print(f"Skipped timetable entries while saving: {skipped}")
+            session['success_message'] = message
 
             return redirect(url_for('view_saved_timetable'))
 
         except Exception as e:
             # Handle errors with more detailed information
-            import traceback
             error_msg = f"Error saving timetable: {str(e)}\n{traceback.format_exc()}"
             print(error_msg)
             return render_template('index.html', error=f"Error saving timetable: {str(e)}")
 
 
+def load_saved_timetable(cursor):
+    """
+    The saved timetable as ``(timetable, batches)``: {BatchKey: {day: ["Subject (Teacher)" or "", ...]}}
+    in the same shape create_timetable returns. ``cursor`` must be a dictionary cursor.
+    """
+    # Get unique batches
+    batch_query = """
+    SELECT DISTINCT course_id, year, semester, batch_id 
+    FROM timetable_assignments
+    ORDER BY course_id, year, semester, batch_id
+    """
+    cursor.execute(batch_query)
+    batches = [BatchKey.of(row['course_id'], row['year'], row['semester'], row['batch_id'])
+               for row in cursor.fetchall()]
+
+    # Initialize timetable structure
+    timetable = {batch: {day: [""] * periods_per_day for day in days} for batch in batches}
+
+    # Get timetable assignments
+    assignment_query = """
+    SELECT 
+        ta.course_id, ta.year, ta.semester, ta.batch_id, ta.day, ta.period,
+        cs.subject_name, CONCAT(td.first_name, ' ', td.last_name) as teacher_name
+    FROM timetable_assignments ta
+    JOIN course_subjects cs ON ta.subject_id = cs.id
+    JOIN teacher_details td ON ta.teacher_id = td.id
+    ORDER BY ta.course_id, ta.year, ta.semester, ta.batch_id, ta.day_ordinal, ta.period
+    """
+    cursor.execute(assignment_query)
+
+    # Fill the timetable
+    for assignment in cursor.fetchall():
+        batch = BatchKey.of(assignment['course_id'], assignment['year'],
+                            assignment['semester'], assignment['batch_id'])
+        day = assignment['day']
+        period = int(assignment['period'])
+        if day in timetable[batch] and 0 <= period < periods_per_day:
+            timetable[batch][day][period] = f"{assignment['subject_name']} ({assignment['teacher_name']})"
+
+    return timetable, batches
+
+
 @app.route('/view_saved_timetable')
 def view_saved_timetable():
     """Retrieve and display the saved timetable"""
     try:
         # Connect to the database
         db = get_db_connection()
+        ensure_schema(db)  # reads sort on day_ordinal
         cursor = db.cursor(dictionary=True)
 
-        # Get unique batches
-        batch_query = """
-        SELECT DISTINCT course_id, year, semester, batch_id 
-        FROM timetable_assignments
-        ORDER BY year, semester, batch_id
-        """
-        cursor.execute(batch_query)
-        batch_results = cursor.fetchall()
+        timetable, batches = load_saved_timetable(cursor)
+        cursor.close()
 
-        if not batch_results:
+        if not batches:
             # Instead of using saved_timetable.html, use index.html with a message
             return render_template('index.html',
                                    message="No saved timetable found. Please generate a new timetable.")
 
-        # Build batch strings - ensure consistent formatting
-        batches = []
-        for batch in batch_results:
-            # Convert all values to strings to avoid type issues
-            course_id = str(batch['course_id'])
-            year = str(batch['year'])
-            semester = str(batch['semester'])
-            batch_id = str(batch['batch_id'])
-            batch_str = f"{course_id},{year}, {semester}, {batch_id}"
-            batches.append(batch_str)
-
-        # Initialize timetable structure
-        timetable = {batch: {day: [""] * periods_per_day for day in days} for batch in batches}
-
-        # Get timetable assignments
-        assignment_query = """
-        SELECT 
-            ta.course_id, ta.year, ta.semester, ta.batch_id, ta.day, ta.period,
-            cs.subject_name, CONCAT(td.first_name, ' ', td.last_name) as teacher_name
-        FROM timetable_assignments ta
-        JOIN course_subjects cs ON ta.subject_id = cs.id
-        JOIN teacher_details td ON ta.teacher_id = td.id
-        ORDER BY ta.year, ta.semester, ta.batch_id, FIELD(ta.day, 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'), ta.period
-        """
-        cursor.execute(assignment_query)
-        assignments = cursor.fetchall()
-
-        # Fill the timetable with consistent string formatting
-        for assignment in assignments:
-            # Convert all values to strings to ensure consistency
-            course_id = str(assignment['course_id'])
-            year = str(assignment['year'])
-            semester = str(assignment['semester'])
-            batch_id = str(assignment['batch_id'])
-            batch_str = f"{course_id},{year}, {semester}, {batch_id}"
-
-            day = assignment['day']
-            period = assignment['period']
-            subject = assignment['subject_name']
-            teacher = assignment['teacher_name']
-
-            # Make sure period is an integer index
-            period_idx = int(period)
-            if 0 <= period_idx < periods_per_day:
-                timetable[batch_str][day][period_idx] = f"{subject} ({teacher})"
-
-        cursor.close()
-        db.close()
-
         # Get success message from session
         success_message = session.pop('success_message', None)
 
@@ -998,13 +3301,14 @@ def edit_timetable():
     try:
         # Connect to the database
         db = get_db_connection()
+        ensure_schema(db)  # reads sort on day_ordinal
         cursor = db.cursor(dictionary=True)
 
         # Get unique batches
         batch_query = """
         SELECT DISTINCT course_id, year, semester, batch_id 
         FROM timetable_assignments
-        ORDER BY year, semester, batch_id
+        ORDER BY course_id, year, semester, batch_id
         """
         cursor.execute(batch_query)
         batch_results = cursor.fetchall()
@@ -1013,16 +3317,8 @@ def edit_timetable():
             return render_template('index.html',
                                    message="No saved timetable found. Please generate a new timetable.")
 
-        # Build batch strings
-        batches = []
-        for batch in batch_results:
-            # Convert all values to strings to avoid type issues
-            course_id = str(batch['course_id'])
-            year = str(batch['year'])
-            semester = str(batch['semester'])
-            batch_id = str(batch['batch_id'])
-            batch_str = format_batch_string(course_id, year, semester, batch_id)
-            batches.append(batch_str)
+        batches = [BatchKey.of(row['course_id'], row['year'], row['semester'], row['batch_id'])
+                   for row in batch_results]
 
         # Initialize timetable structure
         timetable = {batch: {day: [""] * periods_per_day for day in days} for batch in batches}
@@ -1036,19 +3332,15 @@ def edit_timetable():
         FROM timetable_assignments ta
         JOIN course_subjects cs ON ta.subject_id = cs.id
         JOIN teacher_details td ON ta.teacher_id = td.id
-        ORDER BY ta.year, ta.semester, ta.batch_id, FIELD(ta.day, 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'), ta.period
+        ORDER BY ta.course_id, ta.year, ta.semester, ta.batch_id, ta.day_ordinal, ta.period
         """
         cursor.execute(assignment_query)
         assignments = cursor.fetchall()
 
         # Fill the timetable
         for assignment in assignments:
-            batch_str = format_batch_string(
-                str(assignment['course_id']),
-                str(assignment['year']),
-                str(assignment['semester']),
-                str(assignment['batch_id'])
-            )
+            batch = BatchKey.of(assignment['course_id'], assignment['year'],
+                                assignment['semester'], assignment['batch_id'])
 
             day = assignment['day']
             period = int(assignment['period'])
@@ -1059,7 +3351,7 @@ def edit_timetable():
 
             if 0 <= period < periods_per_day:
                 # Include subject_id and teacher_id for editing purposes
-                timetable[batch_str][day][period] = {
+                timetable[batch][day][period] = {
                     "display": f"{subject} ({teacher})",
                     "subject_name": subject,
                     "teacher_name": teacher,
@@ -1067,51 +3359,53 @@ def edit_timetable():
                     "teacher_id": teacher_id
                 }
 
-        # Get all available subjects and their assigned teachers for each batch
-        all_subjects = {}
-
-        for batch in batches:
-            course_id, year, semester, batch_id = parse_batch_string(batch)
-
-            subject_query = """
-            SELECT 
-                cs.id as subject_id, cs.subject_name, cs.subject_code,
-                td.id as teacher_id, CONCAT(td.first_name, ' ', td.last_name) as teacher_name
-            FROM course_subjects cs
-            JOIN subject_assignments sa ON cs.id = sa.course_subject_id
-            JOIN teacher_details td ON sa.teacher_id = td.id
-            WHERE cs.course_id = %s AND cs.year = %s AND cs.semester = %s AND cs.batch_id = %s AND cs.is_active = 1
-            ORDER BY cs.subject_name, teacher_name
-            """
-            cursor.execute(subject_query, (course_id, year, semester, batch_id))
-            subject_results = cursor.fetchall()
-
-            # Group subjects with their assigned teachers
-            batch_subjects = {}
-            for row in subject_results:
-                subject_name = row['subject_name']
-                if subject_name not in batch_subjects:
-                    batch_subjects[subject_name] = {
-                        "subject_id": row['subject_id'],
-                        "subject_code": row['subject_code'],
-                        "teachers": []
-                    }
+        # Available subjects and their teachers for every batch, in one query grouped here
+        placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(batches))
+        subject_query = f"""
+        SELECT 
+            cs.course_id, cs.year, cs.semester, cs.batch_id,
+            cs.id as subject_id, cs.subject_name, cs.subject_code,
+            td.id as teacher_id, CONCAT(td.first_name, ' ', td.last_name) as teacher_name
+        FROM course_subjects cs
+        JOIN subject_assignments sa ON cs.id = sa.course_subject_id
+        JOIN teacher_details td ON sa.teacher_id = td.id
+        WHERE cs.is_active = 1 AND (cs.course_id, cs.year, cs.semester, cs.batch_id) IN ({placeholders})
+        ORDER BY cs.subject_name, teacher_name
+        """
+        cursor.execute(subject_query, [part for batch in batches for part in batch])
+
+        # Group subjects with their assigned teachers, per batch
+        options = {}
+        for row in cursor.fetchall():
+            key = BatchKey.of(row['course_id'], row['year'], row['semester'], row['batch_id'])
+            batch_subjects = options.setdefault(key, {})
+            subject_name = row['subject_name']
+            if subject_name not in batch_subjects:
+                batch_subjects[subject_name] = {
+                    "subject_id": row['subject_id'],
+                    "subject_code": row['subject_code'],
+                    "teachers": []
+                }
 
-                batch_subjects[subject_name]["teachers"].append({
-                    "teacher_id": row['teacher_id'],
-                    "teacher_name": row['teacher_name']
-                })
+            batch_subjects[subject_name]["teachers"].append({
+                "teacher_id": row['teacher_id'],
+                "teacher_name": row['teacher_name']
+            })
+        all_subjects = {batch: options.get(batch, {}) for batch in batches}
 
-            all_subjects[batch] = batch_subjects
+        # Versions the editor sends back so concurrent edits of a batch are detected
+        version_cursor = db.cursor()
+        stored_versions = fetch_batch_versions(version_cursor)
+        version_cursor.close()
+        batch_versions = {batch: stored_versions.get(batch, 0) for batch in batches}
 
         cursor.close()
-        db.close()
         course_map = get_course_map()
-        print(course_map)
-        session['timetable'] = json.dumps(timetable)
+        session['result_id'] = store_timetable(timetable, batches)
         return render_template('edit_timetable.html',
                                timetable=timetable,
                                batches=batches,
+                               batch_versions=batch_versions,
                                days=days,
                                periods_per_day=periods_per_day,
                                all_subjects=all_subjects,
@@ -1126,49 +3420,82 @@ def edit_timetable():
 
 @app.route('/update_timetable', methods=['POST'])
 def update_timetable():
-    """Save the modified timetable to the database"""
+    """
+    Apply the editor's changed cells to the database, batch by batch.
+
+    The editor posts only dirty cells plus the version of each batch it
+    loaded. A batch whose stored version moved on since then was changed by
+    someone else and is skipped rather than overwritten.
+    """
     if request.method == 'POST':
         try:
-            # Get the timetable data from the form
-            timetable_data = json.loads(request.form.get('timetable_data', '{}'))
+            # Get the changed cells from the form
+            payload = json.loads(request.form.get('timetable_changes', '{}'))
+            batch_edits = payload.get('changes', {})
+            loaded_versions = payload.get('versions', {})
 
-            if not timetable_data:
-                return redirect(url_for('index', error="No timetable data received"))
+            if not batch_edits:
+                session['success_message'] = "No changes to save."
+                return redirect(url_for('view_saved_timetable'))
 
             # Connect to the database
             db = get_db_connection()
             cursor = db.cursor()
+            ensure_schema(db)
 
-            # First, clear existing timetable entries
-            clear_query = "DELETE FROM timetable_assignments WHERE 1=1"
-            cursor.execute(clear_query)
-
-            # Insert the new timetable data
-            for batch, batch_data in timetable_data.items():
-                # Parse batch information
-                course_id, year, semester, batch_id = parse_batch_string(batch)
-
-                for day, day_data in batch_data.items():
-                    for period, entry in enumerate(day_data):
-                        if entry and entry.get('subject_id') and entry.get('teacher_id'):
-                            # Insert the assignment using the subject_id and teacher_id
-                            insert_query = """
-                            INSERT INTO timetable_assignments 
-                            (course_id, year, semester, batch_id, day, period, subject_id, teacher_id, created_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                            """
-                            cursor.execute(insert_query, (
-                                course_id, year, semester, batch_id, day, period,
-                                entry['subject_id'], entry['teacher_id']
-                            ))
-
-            # Commit the changes
-            db.commit()
-            cursor.close()
-            db.close()
+            changed = 0
+            updated_batches = 0
+            conflicts = []
+            applied = {}
+            new_batches = 0
+            try:
+                for name, cells in batch_edits.items():
+                    batch = BatchKey.parse(name)
+                    if batch is None:
+                        continue
+
+                    # Optimistic concurrency: the batch must still be at the version the editor loaded
+                    stored_version = lock_batch_version(cursor, batch)
+                    if stored_version != int(loaded_versions.get(name, 0)):
+                        conflicts.append(name)
+                        continue
+
+                    changes = {}
+                    for cell in cells:
+                        value = None
+                        if cell.get('subject_id') and cell.get('teacher_id'):
+                            value = (int(cell['subject_id']), int(cell['teacher_id']))
+                        changes[(cell['day'], int(cell['period']))] = value
+
+                    batch_changed = apply_batch_changes(cursor, batch, changes)
+                    if batch_changed:
+                        bump_batch_version(cursor, batch)
+                        updated_batches += 1
+                        applied[batch] = changes
+                        new_batches += stored_version == 0
+                    changed += batch_changed
+
+                # Commit the changes
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            else:
+                try:
+                    if applied:
+                        update_saved_teacher_index(cursor, applied, new_batches)
+                except Exception as e:
+                    # The index stamp no longer matches, so the next read rebuilds it
+                    print(f"Error refreshing the teacher index: {str(e)}")
+            finally:
+                cursor.close()
 
             # Store success message in session
-            session['success_message'] = "Timetable successfully updated!"
+            message = f"Timetable successfully updated! {changed} cells changed in {updated_batches} batches."
+            if conflicts:
+                message += (f" Not saved because they were changed by someone else first: {', '.join(conflicts)}."
+                            " Reload the editor to see their changes.")
+            session['success_message'] = message
 
             return redirect(url_for('view_saved_timetable'))
 
@@ -1179,6 +3506,48 @@ def update_timetable():
             return render_template('index.html', error=f"Error updating timetable: {str(e)}")
 
 
+@app.route('/repair_timetable', methods=['POST'])
+def repair_saved_timetable():
+    """
+    Repair the saved timetable against the current subjects, period limits and
+    teacher assignments, starting from what is saved instead of from scratch.
+    The result is shown like a generated timetable, to be reviewed and saved.
+    """
+    try:
+        db = get_db_connection()
+        ensure_schema(db)  # reads sort on day_ordinal
+        cursor = db.cursor(dictionary=True)
+        timetable, batches = load_saved_timetable(cursor)
+        cursor.close()
+
+        if not batches:
+            return render_template('index.html',
+                                   message="No saved timetable found. Please generate a new timetable.")
+
+        # Batches whose subject limits changed since the last save; kept until a repaired result is saved
+        touched = [BatchKey.parse(name) for name in session.get('repair_batches', [])]
+        time_limit = parse_seconds(request.form.get('time_limit', ''))
+        time_limit = min(max(time_limit, 1), 60) if time_limit is not None else 5
+
+        subjects = fetch_subjects_and_teachers()
+        started = time.perf_counter()
+        timetable, batches, repaired = repair_timetable(timetable, batches, subjects, touched, time_limit)
+        seconds = time.perf_counter() - started
+
+        if repaired:
+            message = (f"Repaired {len(repaired)} of {len(batches)} batches in {seconds:.1f}s: "
+                       f"{', '.join(str(batch) for batch in repaired)}. Other batches are unchanged. "
+                       "Review and save to keep the repair.")
+        else:
+            message = "The saved timetable already fits the current configuration; nothing to repair."
+        return _render_result(timetable, batches, subjects, success_message=message)
+
+    except Exception as e:
+        error_msg = f"Error repairing timetable: {str(e)}\n{traceback.format_exc()}"
+        print(error_msg)
+        return render_template('index.html', error=f"Error repairing timetable: {str(e)}")
+
+
 PERIOD_TIMES = [
     "09:00 - 09:55",
     "10:00 - 10:55",
@@ -1189,6 +3558,75 @@ PERIOD_TIMES = [
 ]
 
 
+def fetch_timetable_version(cursor):
+    """
+    A stamp that changes whenever a save changes timetable_assignments: every
+    such save bumps some batch's version, so the sum of versions only grows.
+    """
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(version), 0) FROM timetable_batch_versions")
+    count, total = cursor.fetchone()
+    return int(count), int(total)
+
+
+PRINT_QUERY = """
+    SELECT ta.course_id, ta.year, ta.semester, ta.batch_id,
+           ta.day, ta.period, ta.subject_id, ta.teacher_id,
+           cs.subject_name, cs.subject_code,
+           CONCAT(td.first_name, ' ', td.last_name) as teacher_name
+    FROM timetable_assignments ta
+    JOIN course_subjects cs ON ta.subject_id = cs.id
+    JOIN teacher_details td ON ta.teacher_id = td.id
+"""
+
+
+def build_print_pages(assignments, course_map, days, periods_per_day):
+    """
+    Build one print page per batch in a single pass over assignment rows.
+
+    Each page holds the batch details, its day -> periods grid and the subject
+    summary (unique subjects with the first teacher seen, sorted by name), so
+    read the rows in day/period order within a batch. Pages come out in the
+    order their batches first appear in ``assignments``.
+    """
+    pages = {}
+    for assignment in assignments:
+        key = BatchKey.of(assignment['course_id'], assignment['year'],
+                          assignment['semester'], assignment['batch_id'])
+        page = pages.get(key)
+        if page is None:
+            page = pages[key] = {
+                'course_name': course_map.get(key.course_id, "Unknown Course"),
+                'year': key.year,
+                'semester': key.semester,
+                'batch_id': key.batch_id,
+                'timetable': {day: [None] * periods_per_day for day in days},
+                'subjects': {}
+            }
+
+        day = assignment['day']
+        period = int(assignment['period'])
+        # Skip cells outside the printed grid
+        if day not in page['timetable'] or not 0 <= period < periods_per_day:
+            continue
+
+        page['timetable'][day][period] = {
+            'subject_id': assignment['subject_id'],
+            'teacher_id': assignment['teacher_id'],
+            'subject_name': assignment['subject_name'],
+            'subject_code': assignment['subject_code'],
+            'teacher_name': assignment['teacher_name']
+        }
+        page['subjects'].setdefault(assignment['subject_id'], {
+            'subject_name': assignment['subject_name'],
+            'subject_code': assignment['subject_code'],
+            'teacher_name': assignment['teacher_name']
+        })
+
+    for page in pages.values():
+        page['subjects'] = sorted(page['subjects'].values(), key=lambda x: x['subject_name'])
+    return list(pages.values())
+
+
 @app.route('/print_timetable')
 def print_timetable():
     # Get query parameters for batch selection (optional, can default to first batch)
@@ -1197,6 +3635,10 @@ def print_timetable():
     semester = request.args.get('semester')
     batch_id = request.args.get('batch_id')
 
+    db = get_db_connection()
+    ensure_schema(db)  # the grid is read in day_ordinal order
+    cursor = db.cursor(dictionary=True)
+
     # If no parameters provided, use first batch
     if not all([course_id, year, semester, batch_id]):
         # Get the first batch from the database
@@ -1206,8 +3648,6 @@ def print_timetable():
             ORDER BY course_id, year, semester, batch_id 
             LIMIT 1
         """
-        db = get_db_connection()
-        cursor = db.cursor(dictionary=True)
         cursor.execute(query)
         result = cursor.fetchone()
 
@@ -1217,92 +3657,78 @@ def print_timetable():
             semester = result['semester']
             batch_id = result['batch_id']
 
-    # Get course name
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT name FROM courses WHERE id = %s", (course_id,))
-    course_result = cursor.fetchone()
-    course_name = course_result['name'] if course_result else "Unknown Course"
-
-    # Get days and periods_per_day (assuming these are constants or configuration)
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
-    periods_per_day = 7  # Adjust as needed
-
-    # Get timetable data
-    timetable = {day: [None] * periods_per_day for day in days}
-    query = """
-        SELECT ta.day, ta.period, ta.subject_id, ta.teacher_id, 
-               cs.subject_name, cs.subject_code,
-               CONCAT(td.first_name, ' ', td.last_name) as teacher_name
-        FROM timetable_assignments ta
-        JOIN course_subjects cs ON ta.subject_id = cs.id
-        JOIN teacher_details td ON ta.teacher_id = td.id
+    # Get timetable data in grid order, so the summary's teacher is the first one in the week
+    cursor.execute(PRINT_QUERY + """
         WHERE ta.course_id = %s AND ta.year = %s AND ta.semester = %s AND ta.batch_id = %s
-    """
-
-    cursor.execute(query, (course_id, year, semester, batch_id))
+        ORDER BY ta.day_ordinal, ta.period
+    """, (course_id, year, semester, batch_id))
     assignments = cursor.fetchall()
-
-    for assignment in assignments:
-        day = assignment['day']
-        period = int(assignment['period'])  # Ensure period is an integer
-        
-        # Skip if day is not in our days list
-        if day not in timetable:
-            continue
-            
-        # Skip if period is out of range
-        if period < 0 or period >= periods_per_day:
-            continue
-            
-        timetable[day][period] = {
-            'subject_id': assignment['subject_id'],
-            'teacher_id': assignment['teacher_id'],
-            'subject_name': assignment['subject_name'],
-            'subject_code': assignment['subject_code'],
-            'teacher_name': assignment['teacher_name']
-        }
-
-    # Get subject summary (unique subject-teacher combinations)
-    subjects = []
-    subject_dict = {}
-
-    for day in days:
-        for period in range(periods_per_day):
-            if timetable[day][period]:
-                subject_id = timetable[day][period]['subject_id']
-                if subject_id not in subject_dict:
-                    subject_dict[subject_id] = {
-                        'subject_name': timetable[day][period]['subject_name'],
-                        'subject_code': timetable[day][period]['subject_code'],
-                        'teacher_name': timetable[day][period]['teacher_name']
-                    }
-
-    subjects = list(subject_dict.values())
-
-    # Sort subjects by name
-    subjects.sort(key=lambda x: x['subject_name'])
-
-    # Get current date for footer
-    current_date = datetime.now().strftime("%d-%m-%Y")
-    
-    # Close the database connection
     cursor.close()
-    db.close()
+
+    course_map = get_course_map()
+    pages = build_print_pages(assignments, course_map, days, periods_per_day)
+    if not pages:
+        # Nothing saved for this batch yet: print an empty grid
+        pages = [{
+            'course_name': course_map.get(str(course_id), "Unknown Course"),
+            'year': year,
+            'semester': semester,
+            'batch_id': batch_id,
+            'timetable': {day: [None] * periods_per_day for day in days},
+            'subjects': []
+        }]
 
     return render_template(
         'print_timetable.html',
-        course_name=course_name,
-        year=year,
-        semester=semester,
-        batch_id=batch_id,
+        pages=pages,
+        pdf_filename=f"{pages[0]['course_name']}_{year}_Sem{semester}_Batch{batch_id}_Timetable.pdf",
         days=days,
         periods_per_day=periods_per_day,
         period_times=PERIOD_TIMES,
-        timetable=timetable,
-        subjects=subjects,
-        current_date=current_date
+        # Get current date for footer
+        current_date=datetime.now().strftime("%d-%m-%Y")
     )
 
+
+@app.route('/print_all_timetables')
+def print_all_timetables():
+    """
+    Every saved batch in one print document, one page per batch.
+
+    Built from one query and one pass over its rows, and cached until a save
+    changes timetable_assignments (or course names change).
+    """
+    try:
+        db = get_db_connection()
+        ensure_schema(db)  # the cache stamp reads timetable_batch_versions
+        cursor = db.cursor()
+        version = fetch_timetable_version(cursor)
+        cursor.close()
+
+        def render():
+            cursor = db.cursor(dictionary=True)
+            cursor.execute(PRINT_QUERY + " ORDER BY ta.course_id, ta.year, ta.semester, ta.batch_id,"
+                                         " ta.day_ordinal, ta.period")
+            assignments = cursor.fetchall()
+            cursor.close()
+
+            pages = build_print_pages(assignments, get_course_map(), days, periods_per_day)
+            return render_template(
+                'print_timetable.html',
+                pages=pages,
+                pdf_filename="All_Timetables.pdf",
+                days=days,
+                periods_per_day=periods_per_day,
+                period_times=PERIOD_TIMES,
+                current_date=datetime.now().strftime("%d-%m-%Y")
+            )
+
+        return _cached('print_all_timetables', render, stamp=version)
+
+    except Exception as e:
+        error_msg = f"Error printing timetables: {str(e)}\n{traceback.format_exc()}"
+        print(error_msg)
+        return render_template('index.html', error=f"Error printing timetables: {str(e)}")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
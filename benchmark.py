@@ -0,0 +1,233 @@
+"""
+Solver micro-benchmarks on synthetic institutions, no database needed.
+
+    python benchmark.py                                # run every size and print the results
+    python benchmark.py --sizes small medium           # only some sizes
+    python benchmark.py --save baseline.json           # keep the results as a JSON baseline
+    python benchmark.py --baseline baseline.json       # fail if anything regressed against it
+    python benchmark.py --snapshot prod.ttsnap         # also benchmark a real instance exported from /snapshot
+
+Rates (``*_per_sec``) are higher-is-better; times and memory are
+lower-is-better. Penalties, violations, the solvers' run times (both stop
+early once a timetable is good enough, and the annealer otherwise runs to
+its time limit) and times to the first feasible timetable are reported but
+not compared, since they depend on the search rather than the code's speed;
+``ga_generations_per_sec`` is the GA's code-speed figure.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import app
+
+# Synthetic institution sizes; keyword arguments for synthetic_institution
+SIZES = {
+    "small": {"n_batches": 8, "subjects_per_batch": 6},
+    "medium": {"n_batches": 24, "subjects_per_batch": 7},
+    "large": {"n_batches": 60, "subjects_per_batch": 8},
+}
+
+# Metrics that measure the search rather than the code; reported, never compared
+SEARCH_METRICS = ("penalty", "violations", "time_to_feasible", "annealing_seconds", "ga_seconds")
+
+# Settings for the full create_timetable runs
+GA_OPTIONS = {"population_size": 30, "generations": 100, "mutation_rate": 0.1}
+ANNEALING_OPTIONS = {"time_limit": 5}
+
+
+def synthetic_institution(n_batches=10, subjects_per_batch=6, shared_teacher_ratio=0.3,
+                          teachers_per_subject=(1, 2), max_per_day=(1, 2), max_per_week=(2, 5), seed=0):
+    """
+    Return a subjects dict shaped like app.fetch_subjects_and_teachers() output.
+
+    Each teacher entry of a subject comes from a pool shared across batches
+    with probability ``shared_teacher_ratio`` (roughly four subjects per
+    shared teacher), otherwise it is a teacher dedicated to that subject.
+    ``teachers_per_subject``, ``max_per_day`` and ``max_per_week`` are
+    inclusive (low, high) ranges.
+    """
+    rng = random.Random(seed)
+    shared_pool = max(1, round(n_batches * subjects_per_batch * shared_teacher_ratio / 4))
+    shared = [{"id": t + 1, "name": f"Shared Teacher{t + 1}"} for t in range(shared_pool)]
+    next_teacher_id = shared_pool + 1
+    next_subject_id = 1
+
+    subjects = {}
+    for b in range(n_batches):
+        course_id = b // 8 + 1
+        batch = app.BatchKey.of(course_id, b // 2 % 4 + 1, b % 2 + 1, b + 1)
+        subjects[batch] = {}
+        for s in range(subjects_per_batch):
+            teachers = []
+            for _ in range(rng.randint(*teachers_per_subject)):
+                if rng.random() < shared_teacher_ratio:
+                    teacher = rng.choice(shared)
+                else:
+                    teacher = {"id": next_teacher_id, "name": f"Teacher{next_teacher_id} Batch{b + 1}"}
+                    next_teacher_id += 1
+                if teacher not in teachers:
+                    teachers.append(teacher)
+
+            subjects[batch][f"Subject {s + 1}"] = {
+                "subject_code": f"SUB{b + 1:03d}{s + 1:02d}",
+                "course_subject_id": next_subject_id,
+                "teachers": teachers,
+                "details": {"course_id": course_id},
+                "constraints": {
+                    "max_periods_per_day": rng.randint(*max_per_day),
+                    "max_periods_per_week": rng.randint(*max_per_week)
+                }
+            }
+            next_subject_id += 1
+    return subjects
+
+
+def _rate(fn, min_time=0.5, repeats=5):
+    """
+    Calls per second of ``fn``: the median of ``repeats`` rounds, each calling
+    it for at least ``min_time`` seconds, so a stray pause or burst doesn't count
+    """
+    rates = []
+    for _ in range(repeats):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        rates.append(calls / elapsed)
+    return round(statistics.median(rates), 1)
+
+
+def _solve(subjects, solver, options, seed=0):
+    """Run create_timetable; returns (seconds, progress events, timetable, batches)"""
+    events = []
+    started = time.perf_counter()
+    timetable, batches, _ = app.create_timetable(solver=solver, seed=seed, subjects=subjects,
+                                                 on_generation=events.append, **options)
+    return time.perf_counter() - started, events, timetable, batches
+
+
+def bench_size(subjects, seed=0):
+    """Benchmark every solver piece on one problem instance"""
+    batches = list(subjects)
+    problem = app.Problem(subjects, batches)
+    random.seed(seed)
+    results = {"batches": len(batches), "teachers": len(problem.teacher_names)}
+
+    population_size = GA_OPTIONS["population_size"]
+    results["init_random_per_sec"] = _rate(lambda: app.generate_initial_population(problem, population_size))
+    results["init_grasp_per_sec"] = _rate(lambda: app.generate_grasp_population(problem, population_size))
+
+    population = app.generate_initial_population(problem, population_size)
+    results["fitness_evals_per_sec"] = round(
+        _rate(lambda: [app.fitness(genome, problem) for genome in population]) * population_size, 1)
+    if app.np is not None:
+        def score_population():
+            for genome in population:
+                genome.score = None
+            app._vectorized_fitness(population, problem)
+        results["vectorized_evals_per_sec"] = round(_rate(score_population) * population_size, 1)
+    app.population_fitness(population, problem)
+
+    results["selection_per_sec"] = _rate(lambda: app.selection(population, problem))
+    results["crossover_per_sec"] = _rate(lambda: app.crossover(population[0], population[1], problem))
+    results["mutate_per_sec"] = _rate(lambda: app.mutate(population[0].copy(), problem, GA_OPTIONS["mutation_rate"]))
+    results["optimize_per_sec"] = _rate(lambda: app.optimize_timetable(population[0].copy(), problem))
+
+    # Full runs: speed, time to the first clash-free best, final quality
+    for solver, options in (("ga", GA_OPTIONS), ("annealing", ANNEALING_OPTIONS)):
+        seconds, events, timetable, batches = _solve(subjects, solver, options, seed)
+        genome = app.encode_timetable(timetable, problem)
+        feasible = next((event["elapsed"] for event in events if event["hard_violations"] == 0), None)
+        results[f"{solver}_seconds"] = round(seconds, 3)
+        results[f"{solver}_time_to_feasible_seconds"] = feasible
+        results[f"{solver}_final_penalty"] = app.fitness(genome, problem)
+        results[f"{solver}_hard_violations"] = app.hard_violations(genome, problem)
+        if solver == "ga":
+            results["ga_generations_per_sec"] = round(len(events) / seconds, 1) if seconds else None
+
+    # Peak Python memory of a full GA run (tracemalloc slows it, so it is measured separately)
+    tracemalloc.start()
+    _solve(subjects, "ga", GA_OPTIONS, seed)
+    results["ga_peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    tracemalloc.stop()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a message for each timing/memory metric more than ``tolerance`` worse than the baseline"""
+    regressions = []
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            before = baseline.get(size, {}).get(name)
+            if value is None or not before or any(part in name for part in SEARCH_METRICS):
+                continue
+            if name.endswith("_per_sec"):
+                worse = value < before * (1 - tolerance)
+            elif name.endswith(("_seconds", "_mb")):
+                worse = value > before * (1 + tolerance)
+            else:
+                continue
+            if worse:
+                regressions.append(f"{size}.{name}: {before} -> {value}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=list(SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--snapshot", metavar="PATH", nargs="+", default=[],
+                        help="problem snapshot files to benchmark as well, reported under their file name")
+    parser.add_argument("--save", metavar="PATH", help="write the results to a JSON baseline file")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown against the baseline (default 0.5 = 50%%)")
+    args = parser.parse_args(argv)
+
+    instances = [(size, lambda size=size: synthetic_institution(seed=args.seed, **SIZES[size])) for size in args.sizes]
+    instances += [(os.path.basename(path), lambda path=path: app.load_snapshot(path)) for path in args.snapshot]
+
+    results = {}
+    for label, load in instances:
+        print(f"Benchmarking {label}...", flush=True)
+        results[label] = bench_size(load(), args.seed)
+        for name, value in results[label].items():
+            print(f"  {name:34} {value}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "numpy": app.np is not None,
+                "results": results
+            }, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
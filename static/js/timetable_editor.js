@@ -8,10 +8,13 @@ let allSubjects = {};
 let currentBatch = '';
 let allDays = [];
 let periodsPerDay = 6;
+// Cell values as loaded, keyed by "batch|day|period", so only edited cells are sent on save
+let initialCells = {};
 
 document.addEventListener('DOMContentLoaded', function() {
     // Load data from hidden inputs
     loadTemplateData();
+    snapshotCells();
     
     // Initialize components
     initializeDragAndDrop();
@@ -442,42 +445,68 @@ function getTeacherOptionsForSubject(subjectId) {
 }
 
 /**
- * Update timetable data in hidden form field
+ * Current value of a timetable cell: subject and teacher ids, or null when free
+ */
+function cellValue(cell) {
+    const content = cell ? cell.querySelector('.timetable-content') : null;
+    if (!content || !content.getAttribute('data-teacher-id')) {
+        return null;
+    }
+    return {
+        subject_id: content.getAttribute('data-subject-id'),
+        teacher_id: content.getAttribute('data-teacher-id')
+    };
+}
+
+/**
+ * Remember every cell's value as loaded
+ */
+function snapshotCells() {
+    document.querySelectorAll('.tab-pane').forEach(tab => {
+        const batchId = tab.getAttribute('data-batch-id');
+        tab.querySelectorAll('.timetable-cell').forEach(cell => {
+            const key = `${batchId}|${cell.getAttribute('data-day')}|${cell.getAttribute('data-period')}`;
+            initialCells[key] = JSON.stringify(cellValue(cell));
+        });
+    });
+}
+
+/**
+ * Update the hidden form field with the cells changed since the page loaded
  */
 function updateTimetableData() {
-    const timetableData = {};
+    const changes = {};
+    const versions = {};
     
     // Process all batches
     document.querySelectorAll('.tab-pane').forEach(tab => {
         const batchId = tab.getAttribute('data-batch-id');
-        timetableData[batchId] = {};
         
-        // Process days and periods
-        const days = allDays || ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'];
-        days.forEach(day => {
-            timetableData[batchId][day] = [];
+        tab.querySelectorAll('.timetable-cell').forEach(cell => {
+            const day = cell.getAttribute('data-day');
+            const period = cell.getAttribute('data-period');
+            const value = cellValue(cell);
             
-            // For each period in this day
-            for (let period = 0; period < (periodsPerDay || 6); period++) {
-                const cell = tab.querySelector(`td[data-day="${day}"][data-period="${period}"]`);
-                const content = cell ? cell.querySelector('.timetable-content') : null;
-                
-                if (content) {
-                    timetableData[batchId][day].push({
-                        subject_id: content.getAttribute('data-subject-id'),
-                        teacher_id: content.getAttribute('data-teacher-id'),
-                        subject_name: content.getAttribute('data-subject-name'),
-                        teacher_name: content.getAttribute('data-teacher-name')
-                    });
-                } else {
-                    timetableData[batchId][day].push(null); // Empty cell
-                }
+            // Skip cells that still hold what was loaded
+            if (JSON.stringify(value) === initialCells[`${batchId}|${day}|${period}`]) {
+                return;
             }
+            
+            if (!changes[batchId]) {
+                changes[batchId] = [];
+                versions[batchId] = parseInt(tab.getAttribute('data-batch-version') || '0');
+            }
+            changes[batchId].push({
+                day: day,
+                period: parseInt(period),
+                subject_id: value ? value.subject_id : null,
+                teacher_id: value ? value.teacher_id : null
+            });
         });
     });
     
     // Update hidden input with JSON data
-    document.getElementById('timetable-data').value = JSON.stringify(timetableData);
+    document.getElementById('timetable-data').value = JSON.stringify({changes: changes, versions: versions});
 }
 
 /**
@@ -0,0 +1,138 @@
+"""
+Cross-checks of the fitness implementations, no database needed.
+
+``fitness`` (flat genes), ``_vectorized_fitness`` (NumPy, whole populations)
+and ``FitnessState`` (incremental, one cell at a time) must all give exactly
+the penalties of the original string-based scoring, kept below as
+``reference_fitness``.
+
+    python -m pytest -q test_fitness.py
+"""
+import random
+
+import pytest
+
+import app
+import benchmark
+
+
+def reference_fitness(timetable, subjects, batches):
+    """The original scoring on {batch: {day: ["Subject (Teacher)", ...]}} timetables"""
+    penalty = 0
+    teacher_schedule = {teacher["name"]: {day: [""] * app.periods_per_day for day in app.days}
+                        for batch in subjects for sub in subjects[batch] for teacher in subjects[batch][sub]["teachers"]}
+
+    for batch in batches:
+        subject_weekly_count = {sub: 0 for sub in subjects[batch]}
+
+        for day in app.days:
+            daily_subject_count = {sub: 0 for sub in subjects[batch]}
+            for period in range(app.periods_per_day):
+                entry = timetable[batch][day][period]
+                if entry:
+                    subject, teacher = entry.rsplit(" (", 1)
+                    teacher = teacher.rstrip(")")
+                    daily_subject_count[subject] += 1
+                    subject_weekly_count[subject] += 1
+                    if daily_subject_count[subject] > subjects[batch][subject]["constraints"]["max_periods_per_day"]:
+                        penalty += 50
+                    if teacher_schedule[teacher][day][period] != "":
+                        penalty += 100
+                    else:
+                        teacher_schedule[teacher][day][period] = batch
+
+        for subject, count in subject_weekly_count.items():
+            max_periods_per_week = subjects[batch][subject]["constraints"]["max_periods_per_week"]
+            if count > max_periods_per_week:
+                penalty += 200 * (count - max_periods_per_week)
+
+        for day in app.days:
+            for period in range(app.periods_per_day - 1):
+                current_entry = timetable[batch][day][period]
+                next_entry = timetable[batch][day][period + 1]
+                if current_entry and next_entry and current_entry.split(" (")[0] == next_entry.split(" (")[0]:
+                    penalty -= 2
+
+        for day in app.days:
+            for period in range(1, app.periods_per_day - 1):
+                prev_entry = timetable[batch][day][period - 1]
+                current_entry = timetable[batch][day][period]
+                next_entry = timetable[batch][day][period + 1]
+                if prev_entry and next_entry and not current_entry:
+                    penalty += 1
+
+    return penalty
+
+
+def reference_score(genome, problem):
+    return reference_fitness(app.decode_timetable(genome, problem), problem.subjects, problem.batches)
+
+
+@pytest.fixture(params=[0, 1, 2])
+def problem(request):
+    # Tight limits and a large shared teacher pool, so every penalty term shows up
+    subjects = benchmark.synthetic_institution(n_batches=6, subjects_per_batch=5, shared_teacher_ratio=0.6,
+                                               max_per_day=(1, 2), max_per_week=(1, 4), seed=request.param)
+    return app.Problem(subjects, list(subjects))
+
+
+def random_genomes(problem, rng, count=20):
+    """Initializer output plus genomes with every cell drawn at random, which break limits far more often"""
+    genomes = app.generate_initial_population(problem, count // 2, rng=rng)
+    for _ in range(count - len(genomes)):
+        cells = []
+        for b, batch_subjects in enumerate(problem.batch_subjects):
+            genes = [gene for s in batch_subjects for gene in problem.subject_genes[s]] + [0]
+            cells.extend(rng.choice(genes) for _ in range(app.cells_per_batch))
+        genomes.append(app.Genome(cells))
+    return genomes
+
+
+def test_fitness_matches_reference(problem):
+    genomes = random_genomes(problem, random.Random(1))
+    assert any(app.hard_violations(genome, problem) for genome in genomes)
+    for genome in genomes:
+        assert app.fitness(genome, problem) == reference_score(genome, problem)
+
+
+def test_vectorized_fitness_matches_fitness(problem):
+    if app.np is None:
+        pytest.skip("NumPy is not installed")
+    genomes = random_genomes(problem, random.Random(2))
+    assert app._vectorized_fitness(genomes, problem) == [app.fitness(genome, problem) for genome in genomes]
+
+
+def test_fitness_state_matches_after_random_edits(problem):
+    rng = random.Random(3)
+    genome = random_genomes(problem, rng, count=2)[1]
+    state = app.FitnessState(genome, problem)
+    assert state.penalty == reference_score(genome, problem)
+
+    for step in range(2000):
+        i = rng.randrange(problem.n_cells)
+        base = i - i % app.cells_per_batch
+        genes = [gene for s in problem.batch_subjects[i // app.cells_per_batch] for gene in problem.subject_genes[s]]
+        if rng.random() < 0.3:
+            # Priced swap; applied half the time
+            j = base + rng.randrange(app.cells_per_batch)
+            changes = [(i, genome.cells[j]), (j, genome.cells[i])]
+            before = state.penalty
+            delta = state.moves_delta(changes)
+            assert state.penalty == before
+            if rng.random() < 0.5:
+                for cell, gene in changes:
+                    state.assign(cell, gene)
+                assert state.penalty == before + delta
+        else:
+            gene = rng.choice(genes) if rng.random() < 0.8 else 0
+            expected = state.penalty + state.move_delta(i, gene)
+            state.assign(i, gene)
+            assert state.penalty == expected
+
+        if step % 100 == 0:
+            assert state.verify()
+            assert state.penalty == reference_score(genome, problem)
+            assert (state.hard, state.penalty) == (app.hard_violations(app.Genome(genome.cells[:]), problem),
+                                                   genome.score)
+
+    assert state.penalty == app.fitness(genome, problem) == reference_score(genome, problem)